@@ -0,0 +1,716 @@
+import heapq
+import itertools
+import json
+import os
+import uuid
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+from artifacts import WEI_SUFFIX, write_artifact, write_artifact_chunks
+
+ZERO_ADDRESS = "0x" + "00" * 20
+
+# Edges a collector graph keeps in memory before spilling them to a sorted run on disk;
+# 0 keeps every edge in memory
+GRAPH_MAX_EDGES = int(os.environ.get("GRAPH_MAX_EDGES", "0"))
+# Runs merged at once, so a long scan never holds a file open per spill
+MERGE_FAN_IN = 64
+# Edges per DataFrame when a spilled graph is streamed to its outputs
+EXPORT_CHUNK_ROWS = 100_000
+
+WEI_PER_ETHER = 10**18
+# Largest amount a column can hold as native integers
+INT64_MAX = np.iinfo(np.int64).max
+
+
+def address_bytes(address):
+    """The 20 raw bytes of an address given as bytes or as a hex string in any case"""
+    return address if isinstance(address, bytes) else bytes.fromhex(address[2:])
+
+
+def wei_to_ether(wei):
+    """Ether floats of a column of exact wei amounts. The whole ether and the remaining
+    wei are split exactly before either becomes a float, so amounts past 2**53 wei keep
+    their precision, and the split runs over the whole column at once."""
+    # Most real totals are past int64, so the range is checked before converting the
+    # column rather than by a conversion that fails
+    if len(wei) and (wei.max() if hasattr(wei, "max") else max(wei)) <= INT64_MAX:
+        wei = np.asarray(wei, dtype=np.int64)
+        whole, rest = wei // WEI_PER_ETHER, wei % WEI_PER_ETHER
+    else:
+        # Past int64 only the remainder is taken on Python ints. The whole ether are then
+        # recovered from the amount as a float, exactly while they stay well below 2**53.
+        wei = np.asarray(wei, dtype=object)
+        rest = (wei % WEI_PER_ETHER).astype(np.int64)
+        whole = np.rint((wei.astype(np.float64) - rest) / WEI_PER_ETHER)
+    return whole.astype(np.float64) + rest.astype(np.float64) / WEI_PER_ETHER
+
+
+class AmountMetric:
+    """Total amount collected, in wei while aggregating and in both ether and wei in the outputs"""
+
+    name = "amount"
+    # Outputs also carry the exact wei values
+    wei = True
+
+    def add(self, value, collect):
+        return (value or 0) + collect.amount
+
+    def merge(self, value, other):
+        return (value or 0) + other
+
+    def outputs(self, values):
+        # Convert amounts from wei to ether
+        return wei_to_ether(values)
+
+
+class CollectsMetric:
+    """Number of collects"""
+
+    name = "collects"
+    wei = False
+
+    def add(self, value, collect):
+        return (value or 0) + 1
+
+    def merge(self, value, other):
+        return (value or 0) + other
+
+    def outputs(self, values):
+        return np.asarray(values, dtype=np.int64)
+
+
+class PublicationsMetric:
+    """Number of distinct publications collected. The publications are kept as the keys
+    of a dict so the value stays JSON-serializable for checkpoints."""
+
+    name = "publications"
+    wei = False
+
+    def add(self, value, collect):
+        value = value if value is not None else {}
+        value[f"{collect.collected_profile_id}-{collect.publication_id}"] = True
+        return value
+
+    def merge(self, value, other):
+        return {**(value or {}), **other}
+
+    def outputs(self, values):
+        return np.array([len(value) for value in values], dtype=np.int64)
+
+
+# What the aggregators can measure per recipient or edge
+METRICS = {metric.name: metric for metric in (AmountMetric(), CollectsMetric(), PublicationsMetric())}
+
+
+def variant_output_file(aggregator, token, label, metric):
+    """Output file of a variant of an aggregator, e.g. bonsai_collectors_usdc_collects.csv
+    for the collects of the token labelled usdc"""
+    stem, extension = os.path.splitext(aggregator.output_file)
+    if token.lower() != aggregator.token:
+        stem += f"_{label}"
+    if metric != AmountMetric.name:
+        stem += f"_{metric}"
+    return stem + extension
+
+
+def combine_values(existing_df, df, keys, column, sort=True):
+    """Sum a value column over the rows of two output DataFrames that share keys. Where
+    the outputs carry exact wei, those are summed and the ether column derived from them."""
+    wei_column = column + WEI_SUFFIX
+    if wei_column not in df:
+        df = pd.concat([existing_df, df])
+        return df.groupby(keys, as_index=False, sort=sort)[column].sum()
+
+    if wei_column not in existing_df:
+        # Outputs from before the wei columns only have ether floats
+        existing_df = existing_df.assign(**{wei_column: [int(value * WEI_PER_ETHER) for value in existing_df[column]]})
+    df = pd.concat([existing_df, df])
+    df = df.groupby(keys, as_index=False, sort=sort)[wei_column].sum()
+    df.insert(len(df.columns) - 1, column, wei_to_ether(df[wei_column]))
+    return df
+
+
+def output_name(output_file):
+    """Name of an aggregate in checkpoints, from its output file"""
+    return os.path.splitext(os.path.basename(output_file))[0]
+
+
+class RecipientTotals:
+    """Total amount of one token collected per nftRecipient (bonsai_collectors.csv), or
+    another metric of its collects"""
+
+    event = "Collected"
+    # Whether profile owners are looked up for this aggregate, from the ownership index or over RPC
+    needs_owners = False
+
+    def __init__(self, token, output_file="bonsai_collectors.csv", metric=AmountMetric.name, addresses=None):
+        self.token = token.lower()
+        self.token_address = address_bytes(self.token)
+        self.output_file = output_file
+        self.name = output_name(output_file)
+        self.metric = METRICS[metric]
+        self.addresses = addresses if addresses is not None else AddressTable()
+        # Recipient address id -> metric value
+        self.collector_amounts = {}
+
+    def __getstate__(self):
+        # An empty partial needs none of the table it shares with its parent in another process
+        state = dict(self.__dict__)
+        if not self.collector_amounts:
+            state["addresses"] = AddressTable()
+        return state
+
+    def partial(self):
+        """An empty aggregate with the same settings, for one block window, sharing this
+        aggregate's address table"""
+        return RecipientTotals(self.token, self.output_file, self.metric.name, self.addresses)
+
+    def variant(self, token, label, metric):
+        """The same aggregate for another token and/or metric"""
+        return RecipientTotals(token, variant_output_file(self, token, label, metric), metric)
+
+    def wants_owner(self, collect):
+        return False
+
+    def add(self, collect, owner_of):
+        # Check if this is a collection in our token
+        if collect.token_address == self.token_address:
+            recipient_id = self.addresses.ids.get(collect.nft_recipient)
+            if recipient_id is None:
+                recipient_id = self.addresses.id_of(collect.nft_recipient)
+            # Add to collector's total
+            self.collector_amounts[recipient_id] = self.metric.add(self.collector_amounts.get(recipient_id), collect)
+
+    def state(self):
+        if not self.collector_amounts:
+            return {}
+        # Address ids become strings in JSON checkpoints
+        return {"addresses": self.addresses.values, "totals": self.collector_amounts}
+
+    def merge_state(self, state):
+        """Add the totals of another state() into this aggregate"""
+        amounts = self.collector_amounts
+        merge = self.metric.merge
+        if "totals" not in state:
+            # An empty state, or a checkpoint from before interning keyed by address
+            for address, amount in state.items():
+                recipient_id = self.addresses.id_of(address)
+                amounts[recipient_id] = merge(amounts.get(recipient_id), amount)
+            return
+
+        if state["addresses"] is self.addresses.values:
+            # A partial sharing our table
+            for recipient_id, amount in state["totals"].items():
+                amounts[recipient_id] = merge(amounts.get(recipient_id), amount)
+            return
+        ids = [self.addresses.id_of(address) for address in state["addresses"]]
+        for recipient_id, amount in state["totals"].items():
+            recipient_id = ids[int(recipient_id)]
+            amounts[recipient_id] = merge(amounts.get(recipient_id), amount)
+
+    @property
+    def column(self):
+        return "total_amount" if self.metric.name == AmountMetric.name else self.metric.name
+
+    def to_dataframe(self):
+        values = list(self.collector_amounts.values())
+        addresses = [self.addresses.address(recipient_id) for recipient_id in self.collector_amounts]
+        df = pd.DataFrame({"address": addresses, self.column: self.metric.outputs(values)})
+        if self.metric.wei:
+            # Python ints, so sums of large amounts neither overflow nor round
+            df[self.column + WEI_SUFFIX] = pd.Series(values, dtype=object)
+        return df
+
+    def combine_frames(self, existing_df, df):
+        """Merge output totals into an existing output's DataFrame. Distinct publication
+        counts can only be added up here, so they may overcount."""
+        return combine_values(existing_df, df, "address", self.column)
+
+    def save_results(self, df):
+        # Sort by total amount in descending order, exactly where the wei are known
+        wei_column = self.column + WEI_SUFFIX
+        df = df.sort_values(wei_column if wei_column in df else self.column, ascending=False)
+
+        # Save to CSV and/or the columnar formats
+        print(f"Results saved to {', '.join(write_artifact(df, self.output_file))}")
+        print(f"Total collectors: {len(df)}")
+
+        # Print top 10 collectors
+        print("\nTop 10 collectors:")
+        print(df.head(10))
+
+    def write_results(self):
+        print(f"Found {len(self.collector_amounts)} collectors of token {self.token}")
+
+        # Check if we have any collectors
+        if not self.collector_amounts:
+            print(f"No collectors of token {self.token} found in this block range")
+            return
+
+        self.save_results(self.to_dataframe())
+
+
+class InternTable:
+    """Dense integer ids for the values of a graph's nodes, in order of first sight, so
+    edges are keyed by ints"""
+
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def id_of(self, value):
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return value_id
+
+
+class AddressTable(InternTable):
+    """InternTable of raw 20 byte addresses, so hex strings are only materialised at
+    export. Hex addresses, such as owners resolved over RPC and those of checkpoints,
+    are converted to bytes first."""
+
+    def id_of(self, address):
+        return super().id_of(address_bytes(address))
+
+    def address(self, address_id):
+        """The lowercase hex address of an id"""
+        return "0x" + self.values[address_id].hex()
+
+
+# Edges are keyed by (from_id << EDGE_ID_BITS) | to_id
+EDGE_ID_BITS = 32
+EDGE_ID_MASK = (1 << EDGE_ID_BITS) - 1
+
+# Spilled runs and merges order edges by their (from, to) ends
+edge_ends = itemgetter(0, 1)
+
+
+def read_run(path):
+    """The (from, to, value) rows of a spilled run, in (from, to) order"""
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+class CollectorGraph:
+    """Edges from each collector to the owner of the collected profile, weighted by the
+    amount of one token collected (or another metric of those collects), skipping zero
+    amounts and self-collects (collector_graph.csv). Addresses are interned to ids and
+    each edge is one packed int key in a dict of metric values. With GRAPH_MAX_EDGES and
+    a spill_dir, edges past the budget are spilled to sorted runs on disk and k-way
+    merged when the graph is written."""
+
+    event = "Collected"
+    needs_owners = True
+
+    def __init__(self, token, output_file="collector_graph.csv", metric=AmountMetric.name, addresses=None):
+        self.token = token.lower()
+        self.token_address = address_bytes(self.token)
+        self.output_file = output_file
+        self.name = output_name(output_file)
+        self.metric = METRICS[metric]
+        self.addresses = addresses if addresses is not None else AddressTable()
+        # Packed (from_id, to_id) -> metric value
+        self.edges = {}
+        # Directory of the spilled runs, None keeps every edge in memory
+        self.spill_dir = None
+        # Files of the runs spilled so far, each sorted by (from, to)
+        self.runs = []
+
+    def __getstate__(self):
+        # An empty partial needs none of the table it shares with its parent in another process
+        state = dict(self.__dict__)
+        if not self.edges:
+            state["addresses"] = AddressTable()
+        return state
+
+    def partial(self):
+        """An empty aggregate with the same settings, for one block window. It shares
+        this graph's address table, so merging it back needs no id mapping."""
+        partial = CollectorGraph(self.token, self.output_file, self.metric.name, self.addresses)
+        partial.spill_dir = self.spill_dir
+        return partial
+
+    def variant(self, token, label, metric):
+        """The same aggregate for another token and/or metric"""
+        return CollectorGraph(token, variant_output_file(self, token, label, metric), metric)
+
+    def wants_owner(self, collect):
+        return collect.amount != 0 and collect.token_address == self.token_address
+
+    def add(self, collect, owner_of):
+        # Skip if amount is zero or this is not a collection in our token
+        if not self.wants_owner(collect):
+            return
+
+        # Get the address that owned the collected profile at the time of the collect
+        collected_from_address = owner_of(collect.collected_profile_id, collect.block_number, collect.log_index)
+        if collected_from_address is None:
+            # Skip this event if the owner could not be resolved (e.g. burned profile)
+            return
+
+        # Known addresses are a single dict lookup
+        ids = self.addresses.ids
+        from_id = ids.get(collect.nft_recipient)
+        if from_id is None:
+            from_id = self.addresses.id_of(collect.nft_recipient)
+        to_id = ids.get(collected_from_address)
+        if to_id is None:
+            to_id = self.addresses.id_of(collected_from_address)
+        if from_id == to_id:
+            # Skip this event if it's a self-collection
+            return
+
+        edge_key = (from_id << EDGE_ID_BITS) | to_id
+        edges = self.edges
+        edges[edge_key] = self.metric.add(edges.get(edge_key), collect)
+
+    def add_edge(self, from_address, to_address, value):
+        """Merge a metric value into the edge between two addresses"""
+        edge_key = (self.addresses.id_of(from_address) << EDGE_ID_BITS) | self.addresses.id_of(to_address)
+        self.edges[edge_key] = self.metric.merge(self.edges.get(edge_key), value)
+        self.maybe_spill()
+
+    def target(self, target_id):
+        """The exported value of the target id of an edge key"""
+        return self.addresses.address(target_id)
+
+    def decoded_edges(self):
+        """The in-memory edges as (from, to, value), with hex addresses"""
+        source, target = self.addresses.address, self.target
+        return (
+            (source(edge_key >> EDGE_ID_BITS), target(edge_key & EDGE_ID_MASK), value)
+            for edge_key, value in self.edges.items()
+        )
+
+    def merged_rows(self, row_iterables):
+        """k-way merge of (from, to)-ordered rows, combining the values of the same edge"""
+        merge = self.metric.merge
+        for (source, target), rows in itertools.groupby(heapq.merge(*row_iterables, key=edge_ends), key=edge_ends):
+            value = None
+            for row in rows:
+                value = merge(value, row[2])
+            yield source, target, value
+
+    def write_run(self, rows):
+        """Write (from, to)-ordered rows to a new run file and return its path"""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{self.name}-{uuid.uuid4().hex}.jsonl")
+        with open(path, "w") as f:
+            f.writelines(json.dumps(row) + "\n" for row in rows)
+        return path
+
+    def maybe_spill(self):
+        """Spill the in-memory edges to a sorted run once they reach GRAPH_MAX_EDGES.
+        Runs are only ever added; superseded ones are deleted once no checkpoint needs
+        them, see prune_spilled_runs() in ingest.py."""
+        if not GRAPH_MAX_EDGES or self.spill_dir is None or len(self.edges) < GRAPH_MAX_EDGES:
+            return
+        self.runs.append(self.write_run(sorted(self.decoded_edges(), key=edge_ends)))
+        self.edges = {}
+        if len(self.runs) >= MERGE_FAN_IN:
+            self.runs = [self.write_run(self.merged_rows(map(read_run, self.runs)))]
+
+    def edge_rows(self):
+        """Every edge as (from, to, value). Spilled runs are k-way merged with the sorted
+        in-memory edges, so the rows then come in (from, to) order."""
+        if not self.runs:
+            return self.decoded_edges()
+        return self.merged_rows([sorted(self.decoded_edges(), key=edge_ends), *map(read_run, self.runs)])
+
+    def state(self):
+        if not self.edges and not self.runs:
+            return {}
+        # Packed edge keys become strings in JSON checkpoints
+        state = {"addresses": self.addresses.values, "edges": self.edges}
+        if self.runs:
+            state["runs"] = list(self.runs)
+        return state
+
+    def merge_state(self, state):
+        """Add the edge values of another state() into this aggregate"""
+        if "edges" not in state:
+            # A checkpoint from before interning, keyed by "from-to" strings
+            for edge in state.values():
+                self.add_edge(edge["from"], edge["to"], edge["value"])
+            return
+
+        self.runs.extend(state.get("runs", ()))
+        self.merge_edges(state)
+        self.maybe_spill()
+
+    def merge_edges(self, state):
+        """Add the in-memory edges of a state() into this graph's edges"""
+        edges = self.edges
+        merge = self.metric.merge
+        if state["addresses"] is self.addresses.values:
+            # A partial sharing our table
+            for edge_key, value in state["edges"].items():
+                edges[edge_key] = merge(edges.get(edge_key), value)
+            return
+
+        # Map the other table's ids to ours once per address rather than once per edge
+        ids = [self.addresses.id_of(address) for address in state["addresses"]]
+        for edge_key, value in state["edges"].items():
+            edge_key = int(edge_key)
+            edge_key = (ids[edge_key >> EDGE_ID_BITS] << EDGE_ID_BITS) | ids[edge_key & EDGE_ID_MASK]
+            edges[edge_key] = merge(edges.get(edge_key), value)
+
+    def rows_dataframe(self, rows):
+        """The output DataFrame of (from, to, value) rows"""
+        sources, targets, values = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+        df = pd.DataFrame({"from": sources, "to": targets, "value": self.metric.outputs(values)})
+        if self.metric.wei:
+            df["value" + WEI_SUFFIX] = pd.Series(values, dtype=object)
+        return df
+
+    def to_dataframe(self):
+        return self.rows_dataframe(list(self.edge_rows()))
+
+    def dataframe_chunks(self):
+        """The output DataFrame in chunks of EXPORT_CHUNK_ROWS edges"""
+        rows = self.edge_rows()
+        while chunk := list(itertools.islice(rows, EXPORT_CHUNK_ROWS)):
+            yield self.rows_dataframe(chunk)
+
+    def combine_frames(self, existing_df, df):
+        """Merge output edge values into an existing output's DataFrame"""
+        return combine_values(existing_df, df, ["from", "to"], "value", sort=False)
+
+    def save_results(self, df):
+        # Save to CSV and/or the columnar formats
+        print(f"Results saved to {', '.join(write_artifact(df, self.output_file))}")
+        print(f"Total relationships: {len(df)}")
+
+        # Print top 10 relationships by value
+        print("\nTop 10 collector relationships by value:")
+        print(df.sort_values("value", ascending=False).head(10))
+
+    def save_chunks(self, chunks):
+        """save_results() for a graph streamed in chunks, keeping only the top 10 edges"""
+        total = 0
+        top = None
+
+        def counted(chunks):
+            nonlocal total, top
+            for df in chunks:
+                total += len(df)
+                top = pd.concat([top, df.nlargest(10, "value")]).nlargest(10, "value")
+                yield df
+
+        print(f"Results saved to {', '.join(write_artifact_chunks(counted(chunks), self.output_file))}")
+        print(f"Total relationships: {total}")
+        print("\nTop 10 collector relationships by value:")
+        print(top.reset_index(drop=True))
+
+    def save(self):
+        """Write the outputs, streamed from the spilled runs if there are any"""
+        if self.runs:
+            self.save_chunks(self.dataframe_chunks())
+        else:
+            self.save_results(self.to_dataframe())
+
+    def write_results(self):
+        print(f"Found {len(self.edges)} collector-collected_from relationships")
+        if self.runs:
+            print(f"Merging them with {len(self.runs)} spilled runs")
+
+        # Check if we have any relationships
+        if not self.edges and not self.runs:
+            print("No collector relationships found in this block range")
+            return
+
+        self.save()
+
+
+class ProfileCollectorGraph(CollectorGraph):
+    """CollectorGraph keyed by the collected profile id during the scan, so collects need
+    no owner lookups. Profile ids are mapped to their current owners in one batch when
+    the graph is written (collector_graph.csv)."""
+
+    def __init__(
+        self, token, owners_of, output_file="collector_graph.csv", metric=AmountMetric.name, addresses=None, profiles=None
+    ):
+        super().__init__(token, output_file, metric, addresses)
+        # Checkpoints of the two graphs are not interchangeable
+        self.name = "profile_" + self.name
+        # Callable mapping a list of profile ids to {profile_id: owner}, None if unresolved
+        self.owners_of = owners_of
+        # Edges go to interned profile ids instead of addresses
+        self.profiles = profiles if profiles is not None else InternTable()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        if not self.edges:
+            state["profiles"] = InternTable()
+        return state
+
+    def partial(self):
+        """An empty aggregate with the same settings, for one block window, sharing this
+        graph's address and profile tables"""
+        partial = ProfileCollectorGraph(
+            self.token, self.owners_of, self.output_file, self.metric.name, self.addresses, self.profiles
+        )
+        partial.spill_dir = self.spill_dir
+        return partial
+
+    def variant(self, token, label, metric):
+        """The same aggregate for another token and/or metric"""
+        return ProfileCollectorGraph(token, self.owners_of, variant_output_file(self, token, label, metric), metric)
+
+    def wants_owner(self, collect):
+        return False
+
+    def add(self, collect, owner_of):
+        # Skip if amount is zero or this is not a collection in our token
+        if collect.amount == 0 or collect.token_address != self.token_address:
+            return
+
+        from_id = self.addresses.ids.get(collect.nft_recipient)
+        if from_id is None:
+            from_id = self.addresses.id_of(collect.nft_recipient)
+        to_id = self.profiles.ids.get(collect.collected_profile_id)
+        if to_id is None:
+            to_id = self.profiles.id_of(collect.collected_profile_id)
+
+        edge_key = (from_id << EDGE_ID_BITS) | to_id
+        edges = self.edges
+        edges[edge_key] = self.metric.add(edges.get(edge_key), collect)
+
+    def target(self, target_id):
+        return self.profiles.values[target_id]
+
+    def state(self):
+        if not self.edges and not self.runs:
+            return {}
+        return {**super().state(), "profiles": self.profiles.values}
+
+    def merge_state(self, state):
+        """Add the edge values of another state() into this aggregate"""
+        if "edges" not in state:
+            # A checkpoint from before interning, keyed by "from-profile_id" strings
+            state = {
+                "addresses": [edge["from"] for edge in state.values()],
+                "profiles": [edge["profile_id"] for edge in state.values()],
+                "edges": {(i << EDGE_ID_BITS) | i: edge["value"] for i, edge in enumerate(state.values())},
+            }
+
+        self.runs.extend(state.get("runs", ()))
+        self.merge_edges(state)
+        self.maybe_spill()
+
+    def merge_edges(self, state):
+        """Add the in-memory edges of a state() into this graph's edges"""
+        edges = self.edges
+        merge = self.metric.merge
+        if state["addresses"] is self.addresses.values and state["profiles"] is self.profiles.values:
+            # A partial sharing our tables
+            for edge_key, value in state["edges"].items():
+                edges[edge_key] = merge(edges.get(edge_key), value)
+            return
+
+        address_ids = [self.addresses.id_of(address) for address in state["addresses"]]
+        profile_ids = [self.profiles.id_of(profile_id) for profile_id in state["profiles"]]
+        for edge_key, value in state["edges"].items():
+            edge_key = int(edge_key)
+            edge_key = (address_ids[edge_key >> EDGE_ID_BITS] << EDGE_ID_BITS) | profile_ids[edge_key & EDGE_ID_MASK]
+            edges[edge_key] = merge(edges.get(edge_key), value)
+
+    def wallet_graph(self):
+        """The graph keyed by wallets: each profile id mapped to its owner, dropping
+        unresolved profiles and self-collects and merging edges that meet"""
+        owners = self.owners_of(sorted(self.profiles.values))
+        wallet_graph = CollectorGraph(self.token, self.output_file, self.metric.name)
+        # A spilled graph is mapped one merged edge at a time and its wallet graph spills in turn
+        wallet_graph.spill_dir = self.spill_dir
+        for from_address, profile_id, value in self.edge_rows():
+            owner = owners.get(profile_id)
+            if owner is None or address_bytes(from_address) == address_bytes(owner):
+                continue
+            wallet_graph.add_edge(from_address, owner, value)
+        return wallet_graph
+
+    def to_dataframe(self):
+        return self.wallet_graph().to_dataframe()
+
+    def write_results(self):
+        print(f"Found {len(self.edges)} collector-profile relationships, resolving their owners...")
+        if self.runs:
+            print(f"Merging them with {len(self.runs)} spilled runs")
+
+        # Check if we have any relationships
+        if not self.edges and not self.runs:
+            print("No collector relationships found in this block range")
+            return
+
+        self.wallet_graph().save()
+
+
+class SignalGraph:
+    """Edges between the two sides of another Lens event, e.g. from the unfollower to the
+    unfollowed profile for Unfollowed, weighted by the number of events. Events from or
+    to the zero address (mints and burns) are skipped."""
+
+    needs_owners = False
+
+    def __init__(self, event, from_arg, to_arg, output_file):
+        self.event = event
+        self.from_arg = from_arg
+        self.to_arg = to_arg
+        self.output_file = output_file
+        self.name = output_name(output_file)
+        self.edges = {}
+
+    def partial(self):
+        """An empty aggregate with the same settings, for one block window"""
+        return SignalGraph(self.event, self.from_arg, self.to_arg, self.output_file)
+
+    def wants_owner(self, collect):
+        return False
+
+    def add(self, event, owner_of):
+        source = str(event["args"][self.from_arg]).lower()
+        target = str(event["args"][self.to_arg]).lower()
+        if ZERO_ADDRESS in (source, target):
+            return
+
+        edge_key = f"{source}-{target}"
+        if edge_key in self.edges:
+            self.edges[edge_key]["count"] += 1
+        else:
+            self.edges[edge_key] = {"from": source, "to": target, "count": 1}
+
+    def state(self):
+        return self.edges
+
+    def merge_state(self, state):
+        """Add the edge counts of another state() into this aggregate"""
+        for edge_key, edge in state.items():
+            if edge_key in self.edges:
+                self.edges[edge_key]["count"] += edge["count"]
+            else:
+                self.edges[edge_key] = dict(edge)
+
+    def to_dataframe(self):
+        return pd.DataFrame(list(self.edges.values()), columns=["from", "to", "count"])
+
+    def combine_frames(self, existing_df, df):
+        """Merge edge counts into an existing output's DataFrame"""
+        df = pd.concat([existing_df, df])
+        return df.groupby(["from", "to"], as_index=False, sort=False)["count"].sum()
+
+    def save_results(self, df):
+        print(f"Results saved to {', '.join(write_artifact(df, self.output_file))}")
+        print(f"Total {self.event} edges: {len(df)}")
+
+    def write_results(self):
+        print(f"Found {len(self.edges)} {self.event} relationships")
+        if not self.edges:
+            return
+
+        self.save_results(self.to_dataframe())
@@ -0,0 +1,145 @@
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Formats the graphs, collector totals and rankings are written in. The first one is
+# also what later stages read back; parquet and arrow need pyarrow.
+ARTIFACT_FORMATS = [fmt.strip() for fmt in os.environ.get("ARTIFACT_FORMATS", "csv").split(",") if fmt.strip()]
+
+FORMATS = ("csv", "parquet", "arrow")
+
+# Exact wei columns are named after their ether column, e.g. total_amount_wei
+WEI_SUFFIX = "_wei"
+
+# Largest precision of an Arrow decimal, so wei totals up to 10**76 - 1 are stored exactly
+WEI_PRECISION = 76
+
+ADDRESS_LENGTH = 20
+
+
+def check_artifact_formats():
+    """Fail before a scan rather than when its results are written"""
+    unknown = [fmt for fmt in ARTIFACT_FORMATS if fmt not in FORMATS]
+    if unknown or not ARTIFACT_FORMATS:
+        raise SystemExit(f"Unknown ARTIFACT_FORMATS {', '.join(unknown)}; choose from {', '.join(FORMATS)}")
+    if pa is None and any(fmt != "csv" for fmt in ARTIFACT_FORMATS):
+        raise SystemExit("ARTIFACT_FORMATS includes parquet or arrow but pyarrow is not installed (pip install pyarrow)")
+
+
+def artifact_file(output_file, fmt):
+    """The file of an artifact in one format, e.g. collector_graph.parquet for collector_graph.csv"""
+    return os.path.splitext(output_file)[0] + "." + fmt
+
+
+def is_address_column(values):
+    return values.dtype == object and all(
+        isinstance(value, str) and len(value) == 2 + 2 * ADDRESS_LENGTH and value.startswith("0x") for value in values
+    )
+
+
+def to_table(df):
+    """An Arrow table of a DataFrame: addresses as 20 byte binaries, *_wei columns as
+    decimals and the other columns as pandas typed them"""
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if name.endswith(WEI_SUFFIX):
+            columns[name] = pa.array([int(value) for value in values], type=pa.decimal256(WEI_PRECISION, 0))
+        elif len(values) and is_address_column(values):
+            columns[name] = pa.array([bytes.fromhex(value[2:]) for value in values], type=pa.binary(ADDRESS_LENGTH))
+        else:
+            columns[name] = pa.Array.from_pandas(values)
+    return pa.table(columns)
+
+
+def from_table(table):
+    """The DataFrame of a to_table() table, with hex addresses and int wei values. Other
+    columns are handed to pandas without a copy where Arrow allows it."""
+    converted = [
+        name
+        for name, column in zip(table.column_names, table.columns)
+        if pa.types.is_fixed_size_binary(column.type) or pa.types.is_decimal(column.type)
+    ]
+    df = table.drop_columns(converted).to_pandas()
+    for name in converted:
+        column = table.column(name).combine_chunks()
+        if pa.types.is_decimal(column.type):
+            df[name] = pd.Series([int(value) for value in column.to_pylist()], dtype=object)
+            continue
+        # One hex() call per column instead of one per address
+        byte_width = column.type.byte_width
+        data = column.buffers()[1].to_pybytes()[column.offset * byte_width:(column.offset + len(column)) * byte_width]
+        hex_values = data.hex()
+        df[name] = ["0x" + hex_values[i:i + 2 * byte_width] for i in range(0, len(hex_values), 2 * byte_width)]
+    return df[table.column_names]
+
+
+def write_artifact(df, output_file):
+    """Write a DataFrame in every ARTIFACT_FORMATS format and return the files written"""
+    return write_artifact_chunks([df], output_file)
+
+
+def write_artifact_chunks(chunks, output_file):
+    """Write DataFrame chunks one after the other in every ARTIFACT_FORMATS format,
+    without holding more than one chunk, and return the files written"""
+    check_artifact_formats()
+    paths = [artifact_file(output_file, fmt) for fmt in ARTIFACT_FORMATS]
+    # Replace the files rather than truncate them, as their previous versions may still
+    # be memory-mapped by the DataFrame being written
+    tmp_paths = [f"{path}.tmp" for path in paths]
+    writers = {}
+    try:
+        for i, df in enumerate(chunks):
+            for fmt, tmp_path in zip(ARTIFACT_FORMATS, tmp_paths):
+                if fmt == "csv":
+                    df.to_csv(tmp_path, index=False, header=i == 0, mode="w" if i == 0 else "a")
+                    continue
+                table = to_table(df)
+                if fmt not in writers:
+                    if fmt == "parquet":
+                        writers[fmt] = pq.ParquetWriter(tmp_path, table.schema)
+                    else:
+                        writers[fmt] = pa.ipc.new_file(tmp_path, table.schema)
+                writers[fmt].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    written = []
+    for tmp_path, path in zip(tmp_paths, paths):
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, path)
+            written.append(path)
+    return written
+
+
+def artifact_exists(output_file):
+    return any(os.path.exists(artifact_file(output_file, fmt)) for fmt in ARTIFACT_FORMATS)
+
+
+def read_artifact(output_file, columns=None):
+    """Read an artifact back as a DataFrame from the first ARTIFACT_FORMATS format it
+    exists in. Arrow files are memory-mapped and parquet files read through a memory map."""
+    check_artifact_formats()
+    for fmt in ARTIFACT_FORMATS:
+        path = artifact_file(output_file, fmt)
+        if not os.path.exists(path):
+            continue
+        if fmt == "csv":
+            # Wei amounts can exceed int64, so they are parsed as Python ints
+            header = pd.read_csv(path, nrows=0).columns
+            converters = {
+                name: int for name in header if name.endswith(WEI_SUFFIX) and (columns is None or name in columns)
+            }
+            # Parse floats back to exactly the values that were written, e.g. for merkle leaves
+            return pd.read_csv(path, usecols=columns, converters=converters, float_precision="round_trip")
+        if fmt == "parquet":
+            return from_table(pq.read_table(path, columns=columns, memory_map=True))
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        return from_table(table.select(columns) if columns else table)
+    raise FileNotFoundError(f"{output_file} not found as {' or '.join(ARTIFACT_FORMATS)}")
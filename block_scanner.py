@@ -0,0 +1,521 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+
+from eth_utils import encode_hex, event_abi_to_log_topic
+
+from rpc_pool import WINDOW_TOO_LARGE_MARKERS, backoff_delay
+
+# How each window's events are fetched: "get_logs" issues one stateless eth_getLogs,
+# "filter" installs a server-side filter and reads it back with eth_getFilterLogs
+LOG_FETCH_MODE = os.environ.get("LOG_FETCH_MODE", "get_logs")
+# How eth_getLogs is sent in get_logs mode: "lean" posts it on a keep-alive session and
+# hands the raw logs to the decoders, "web3" goes through web3's formatters
+LOG_TRANSPORT = os.environ.get("LOG_TRANSPORT", "web3")
+
+# Limits for the adaptive block window
+MIN_BLOCK_INCREMENT = int(os.environ.get("MIN_BLOCK_INCREMENT", "500"))
+MAX_BLOCK_INCREMENT = int(os.environ.get("MAX_BLOCK_INCREMENT", "200000"))
+# A window is grown while it answers faster than this and with fewer logs than this
+WINDOW_TARGET_SECONDS = float(os.environ.get("WINDOW_TARGET_SECONDS", "2"))
+WINDOW_TARGET_RESULTS = int(os.environ.get("WINDOW_TARGET_RESULTS", "2000"))
+
+MAX_RETRIES = 3
+RETRY_DELAY = 2
+
+# Seconds between checkpoints of the scan cursor and partial aggregates
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", "60"))
+
+
+def is_window_too_large(error):
+    """Whether an error means the block window should shrink rather than be retried as is"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(error).__name__:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in WINDOW_TOO_LARGE_MARKERS)
+
+
+def json_default(value):
+    # Raw addresses are kept as bytes in memory and written as hex
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def write_json_atomic(path, data, indent=None):
+    # Write to a temporary file first so a crash never leaves a truncated file behind
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent, default=json_default)
+    os.replace(tmp_path, path)
+
+
+class GapLedger:
+    """On-disk record of block ranges a scan had to skip, so they can be re-fetched
+    later without rescanning the whole history"""
+
+    def __init__(self, path):
+        self.path = path
+        self.gaps = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.gaps = json.load(f)
+
+    def record(self, from_block, to_block, error):
+        self.gaps.append({"from_block": from_block, "to_block": to_block, "error": str(error)})
+        self.save()
+
+    def replace(self, gaps):
+        self.gaps = list(gaps)
+        self.save()
+
+    def clear(self):
+        self.replace([])
+
+    def save(self):
+        write_json_atomic(self.path, self.gaps, indent=2)
+
+
+class ScanCheckpoint:
+    """Periodically saved scan progress: the block ranges already scanned and the
+    partial aggregates built from them, so a later run only scans what is missing.
+    get_state() must return the JSON-serializable aggregates to save."""
+
+    def __init__(self, path, get_state, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.get_state = get_state
+        self.interval = interval
+        self.last_saved = time.monotonic()
+        # Merged [from_block, to_block] ranges whose events are in the saved state
+        self.scanned = []
+        self.state = None
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.scanned = data["scanned"]
+            self.state = data["state"]
+
+    def mark_scanned(self, from_block, to_block):
+        merged = []
+        for start, end in sorted(self.scanned + [[from_block, to_block]]):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.scanned = merged
+
+    def missing_ranges(self, start_block, end_block):
+        """Return the (from_block, to_block) ranges of start_block..end_block not scanned yet"""
+        missing = []
+        cursor = start_block
+        for start, end in self.scanned:
+            if start > end_block:
+                break
+            if start > cursor:
+                missing.append((cursor, start - 1))
+            cursor = max(cursor, end + 1)
+        if cursor <= end_block:
+            missing.append((cursor, end_block))
+        return missing
+
+    def maybe_save(self):
+        if time.monotonic() - self.last_saved >= self.interval:
+            self.save()
+
+    def save(self):
+        write_json_atomic(self.path, {"scanned": self.scanned, "state": self.get_state()})
+        self.last_saved = time.monotonic()
+
+    def reset(self):
+        self.scanned = []
+        self.state = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AdaptiveWindow:
+    """Hands out block windows between start_block and end_block, growing the window
+    while responses are fast and small and halving it when the provider refuses a
+    window for being too large or too slow; it never grows back to a refused size.
+    Finished windows are marked on the checkpoint, if one is given, and so are skipped
+    ones when a gap ledger records them."""
+
+    def __init__(self, start_block, end_block, initial_size,
+                 min_size=MIN_BLOCK_INCREMENT, max_size=MAX_BLOCK_INCREMENT, gap_ledger=None, checkpoint=None):
+        self.end_block = end_block
+        self.cursor = start_block
+        self.min_size = min_size
+        self.max_size = max(min_size, max_size)
+        self.size = min(max(initial_size, self.min_size), self.max_size)
+        # Failed windows waiting to be fetched again, as (from_block, to_block)
+        self.pending = []
+        self.retries = {}
+        self.in_flight = 0
+        # Windows given up on, as GapLedger entries; also written to gap_ledger if given
+        self.skipped = []
+        self.gap_ledger = gap_ledger
+        self.checkpoint = checkpoint
+
+    def claim(self):
+        """Return the next (from_block, to_block) to fetch, or None if nothing is left right now"""
+        if self.pending:
+            window = self.pending.pop()
+        elif self.cursor <= self.end_block:
+            window = (self.cursor, min(self.cursor + self.size - 1, self.end_block))
+            self.cursor = window[1] + 1
+        else:
+            return None
+        self.in_flight += 1
+        return window
+
+    def done(self):
+        return not self.pending and self.cursor > self.end_block and self.in_flight == 0
+
+    def complete(self, from_block, to_block, elapsed, result_count):
+        """Record a successful window and adapt the size of the next ones"""
+        self.in_flight -= 1
+        self.retries.pop((from_block, to_block), None)
+        self._mark_scanned(from_block, to_block)
+
+        if elapsed < WINDOW_TARGET_SECONDS and result_count < WINDOW_TARGET_RESULTS:
+            self.size = min(self.size * 2, self.max_size)
+        elif elapsed > 2 * WINDOW_TARGET_SECONDS or result_count > 2 * WINDOW_TARGET_RESULTS:
+            self.size = max(self.size // 2, self.min_size)
+
+    def fail(self, from_block, to_block, error):
+        """Record a failed window and queue it again, split in half or after a back-off.
+        Returns the number of seconds the caller should wait before its next window."""
+        self.in_flight -= 1
+        print(f"Error processing blocks {from_block} to {to_block}: {error}")
+
+        window_size = to_block - from_block + 1
+        if is_window_too_large(error) and window_size > self.min_size:
+            # Never grow back to a size the provider has refused
+            self.max_size = max(min(self.max_size, window_size - 1), self.min_size)
+            self._split(from_block, to_block)
+            return 0
+
+        retries = self.retries.get((from_block, to_block), 0) + 1
+        if retries < MAX_RETRIES:
+            self.retries[(from_block, to_block)] = retries
+            self.pending.append((from_block, to_block))
+            # Exponential back-off with jitter from RETRY_DELAY
+            return backoff_delay(retries, RETRY_DELAY)
+
+        # Only size errors are worth splitting for; anything else would fail the same way in
+        # every half, so the window is recorded once as it is
+        self.retries.pop((from_block, to_block), None)
+        print(f"Skipping blocks {from_block} to {to_block} after {MAX_RETRIES} retries")
+        self.skipped.append({"from_block": from_block, "to_block": to_block, "error": str(error)})
+        if self.gap_ledger is not None:
+            self.gap_ledger.record(from_block, to_block, error)
+            # The range is accounted for by the gap ledger, so the checkpoint can move past it
+            self._mark_scanned(from_block, to_block)
+        return 0
+
+    def _mark_scanned(self, from_block, to_block):
+        if self.checkpoint is not None:
+            self.checkpoint.mark_scanned(from_block, to_block)
+            self.checkpoint.maybe_save()
+
+    def _split(self, from_block, to_block):
+        half = max((to_block - from_block + 1) // 2, self.min_size)
+        self.size = max(min(self.size, half), self.min_size)
+        middle = from_block + half - 1
+        print(f"Reducing block range to {from_block} to {middle}")
+        # pending is used as a stack, so push the upper half first
+        if middle < to_block:
+            self.pending.append((middle + 1, to_block))
+        self.pending.append((from_block, middle))
+
+
+def event_topic0(contract_event):
+    return encode_hex(event_abi_to_log_topic(contract_event.abi))
+
+
+def log_filter_params(contract_events, from_block, to_block):
+    """eth_getLogs filter matching the address and topic0 of every contract event: an
+    address array and a topic0 OR-list, or plain values for a single event"""
+    addresses = sorted({contract_event.address for contract_event in contract_events})
+    topics = sorted({event_topic0(contract_event) for contract_event in contract_events})
+    return {
+        "address": addresses[0] if len(addresses) == 1 else addresses,
+        "topics": [topics[0] if len(topics) == 1 else topics],
+        "fromBlock": from_block,
+        "toBlock": to_block,
+    }
+
+
+def route_logs(contract_events, logs):
+    """Split the logs of a combined filter into one list per contract event. An address
+    array and a topic0 list also match pairs nobody subscribed to, which are dropped."""
+    keys = [
+        (contract_event.address.lower(), bytes.fromhex(event_topic0(contract_event)[2:]))
+        for contract_event in contract_events
+    ]
+    routed = {key: [] for key in keys}
+    for log in logs:
+        if not log["topics"]:
+            continue
+        subscribed = routed.get((log["address"].lower(), bytes(log["topics"][0])))
+        if subscribed is not None:
+            subscribed.append(log)
+    return [routed[key] for key in keys]
+
+
+def lean_request(contract_events):
+    """The provider's make_lean_request if the lean transport applies to these events"""
+    if LOG_FETCH_MODE != "get_logs" or LOG_TRANSPORT != "lean":
+        return None
+    return getattr(contract_events[0].w3.provider, "make_lean_request", None)
+
+
+def lean_log_params(filter_params):
+    return [{**filter_params, "fromBlock": hex(filter_params["fromBlock"]), "toBlock": hex(filter_params["toBlock"])}]
+
+
+def parse_lean_logs(response):
+    """Turn a raw eth_getLogs response into log dicts the decoders and the LogArchive read:
+    ints for positions and bytes for hashes, topics and data, nothing else converted"""
+    if "error" in response:
+        raise ValueError(response["error"])
+    return [
+        {
+            "address": log["address"],
+            "blockNumber": int(log["blockNumber"], 16),
+            "logIndex": int(log["logIndex"], 16),
+            "transactionIndex": int(log["transactionIndex"], 16),
+            "transactionHash": bytes.fromhex(log["transactionHash"][2:]),
+            "blockHash": bytes.fromhex(log["blockHash"][2:]),
+            "topics": [bytes.fromhex(topic[2:]) for topic in log["topics"]],
+            "data": bytes.fromhex(log["data"][2:]),
+            "removed": log.get("removed", False),
+        }
+        for log in response["result"]
+    ]
+
+
+def fetch_logs(contract_events, from_block, to_block):
+    """Fetch the raw logs of several contract events for one block window in a single
+    request, as one list per event"""
+    w3 = contract_events[0].w3
+    filter_params = log_filter_params(contract_events, from_block, to_block)
+    if LOG_FETCH_MODE == "filter":
+        log_filter = w3.eth.filter(filter_params)
+        return route_logs(contract_events, w3.eth.get_filter_logs(log_filter.filter_id))
+
+    make_lean_request = lean_request(contract_events)
+    if make_lean_request is not None:
+        return route_logs(contract_events, parse_lean_logs(make_lean_request("eth_getLogs", lean_log_params(filter_params))))
+
+    # A single stateless eth_getLogs
+    return route_logs(contract_events, w3.eth.get_logs(filter_params))
+
+
+async def fetch_logs_async(contract_events, from_block, to_block):
+    """Async counterpart of fetch_logs for AsyncWeb3 contract events"""
+    w3 = contract_events[0].w3
+    filter_params = log_filter_params(contract_events, from_block, to_block)
+    if LOG_FETCH_MODE == "filter":
+        log_filter = await w3.eth.filter(filter_params)
+        return route_logs(contract_events, await w3.eth.get_filter_logs(log_filter.filter_id))
+
+    make_lean_request = lean_request(contract_events)
+    if make_lean_request is not None:
+        response = await make_lean_request("eth_getLogs", lean_log_params(filter_params))
+        return route_logs(contract_events, parse_lean_logs(response))
+
+    return route_logs(contract_events, await w3.eth.get_logs(filter_params))
+
+
+def plan_window(contract_events, from_block, to_block, archive):
+    """Split a window into (start, end, archived) pieces, archived only where the
+    LogArchive holds every contract event's logs"""
+    if archive is None:
+        return [(from_block, to_block, False)]
+
+    plans = [
+        archive.plan(contract_event.address, event_topic0(contract_event), from_block, to_block)
+        for contract_event in contract_events
+    ]
+    starts = sorted({start for plan in plans for start, _, _ in plan})
+    pieces = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] - 1 if i + 1 < len(starts) else to_block
+        archived = all(
+            any(piece_start <= start <= piece_end and piece_archived for piece_start, piece_end, piece_archived in plan)
+            for plan in plans
+        )
+        if pieces and pieces[-1][2] == archived:
+            pieces[-1] = (pieces[-1][0], end, archived)
+        else:
+            pieces.append((start, end, archived))
+    return pieces
+
+
+def read_archived(contract_events, start, end, archive, logs):
+    for event_logs, contract_event in zip(logs, contract_events):
+        event_logs.extend(archive.read(contract_event.address, event_topic0(contract_event), start, end))
+
+
+def store_fetched(contract_events, start, end, archive, fetched, logs):
+    for event_logs, event_fetched, contract_event in zip(logs, fetched, contract_events):
+        if archive is not None:
+            archive.store(contract_event.address, event_topic0(contract_event), start, end, event_fetched)
+        event_logs.extend(event_fetched)
+
+
+def fetch_window_event_logs(contract_events, from_block, to_block, archive=None):
+    """Fetch the raw logs of several contract events for one block window, one list per
+    event. Block ranges the LogArchive holds for every event are read from it, and the
+    rest is fetched with one eth_getLogs for all the events."""
+    logs = [[] for _ in contract_events]
+    for start, end, archived in plan_window(contract_events, from_block, to_block, archive):
+        if archived:
+            read_archived(contract_events, start, end, archive, logs)
+        else:
+            store_fetched(contract_events, start, end, archive, fetch_logs(contract_events, start, end), logs)
+    return logs
+
+
+async def fetch_window_event_logs_async(contract_events, from_block, to_block, archive=None):
+    """Async counterpart of fetch_window_event_logs for AsyncWeb3 contract events"""
+    logs = [[] for _ in contract_events]
+    for start, end, archived in plan_window(contract_events, from_block, to_block, archive):
+        if archived:
+            read_archived(contract_events, start, end, archive, logs)
+        else:
+            fetched = await fetch_logs_async(contract_events, start, end)
+            store_fetched(contract_events, start, end, archive, fetched, logs)
+    return logs
+
+
+def fetch_window_logs(contract_event, from_block, to_block, archive=None):
+    """Fetch the raw logs of a contract event for one block window, reading archived
+    block ranges from the LogArchive and only fetching the rest over RPC"""
+    return fetch_window_event_logs([contract_event], from_block, to_block, archive)[0]
+
+
+async def fetch_window_logs_async(contract_event, from_block, to_block, archive=None):
+    """Async counterpart of fetch_window_logs for AsyncWeb3 contract events"""
+    return (await fetch_window_event_logs_async([contract_event], from_block, to_block, archive))[0]
+
+
+def scan_blocks(window, process_window):
+    """Run process_window(from_block, to_block) -> event count over every window handed
+    out by an AdaptiveWindow, one at a time"""
+    while not window.done():
+        from_block, to_block = window.claim()
+        started = time.monotonic()
+        try:
+            result_count = process_window(from_block, to_block)
+        except Exception as e:
+            time.sleep(window.fail(from_block, to_block, e))
+            continue
+        window.complete(from_block, to_block, time.monotonic() - started, result_count)
+
+
+def scan_blocks_pipelined(window, stages, depth):
+    """Run every block window of an AdaptiveWindow through a pipeline of stages, each in
+    its own thread. The first stage takes (from_block, to_block), each later stage the
+    result of the one before, and the last stage, run in the calling thread, returns the
+    window's event count. Queues of `depth` windows between stages hold back a stage that
+    runs ahead, so memory stays bounded. A window that fails in any stage is handed back
+    to the AdaptiveWindow as in scan_blocks."""
+    changed = threading.Condition()
+    # Monotonic time before which no window is fetched, set by a failed window's back-off
+    resume_at = [0.0]
+    queues = [queue.Queue(depth) for _ in stages[1:]]
+    finished = object()
+
+    def claim():
+        with changed:
+            while True:
+                if window.done():
+                    return None
+                claimed = window.claim()
+                if claimed is not None:
+                    return claimed
+                # Windows still in the pipeline may come back split or for a retry
+                changed.wait()
+
+    def first_stage():
+        while True:
+            claimed = claim()
+            if claimed is None:
+                queues[0].put(finished)
+                return
+            time.sleep(max(0.0, resume_at[0] - time.monotonic()))
+            from_block, to_block = claimed
+            started = time.monotonic()
+            try:
+                value, error = stages[0](from_block, to_block), None
+            except Exception as e:
+                value, error = None, e
+            # The first stage's time is what the window size adapts to
+            queues[0].put((from_block, to_block, time.monotonic() - started, value, error))
+
+    def middle_stage(stage, inbox, outbox):
+        while True:
+            item = inbox.get()
+            if item is not finished and item[4] is None:
+                from_block, to_block, elapsed, value, _ = item
+                try:
+                    item = (from_block, to_block, elapsed, stage(value), None)
+                except Exception as e:
+                    item = (from_block, to_block, elapsed, None, e)
+            outbox.put(item)
+            if item is finished:
+                return
+
+    threads = [threading.Thread(target=first_stage, daemon=True)]
+    for stage, inbox, outbox in zip(stages[1:-1], queues, queues[1:]):
+        threads.append(threading.Thread(target=middle_stage, args=(stage, inbox, outbox), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    while True:
+        item = queues[-1].get()
+        if item is finished:
+            break
+        from_block, to_block, elapsed, value, error = item
+        if error is None:
+            try:
+                result_count = stages[-1](value)
+            except Exception as e:
+                error = e
+        with changed:
+            if error is None:
+                window.complete(from_block, to_block, elapsed, result_count)
+            else:
+                resume_at[0] = time.monotonic() + window.fail(from_block, to_block, error)
+            changed.notify_all()
+
+    for thread in threads:
+        thread.join()
+
+
+async def scan_blocks_async(window, process_window, concurrency):
+    """Async counterpart of scan_blocks keeping up to `concurrency` windows in flight"""
+
+    async def worker():
+        while not window.done():
+            claimed = window.claim()
+            if claimed is None:
+                # Other workers still hold windows that may come back split or for a retry
+                await asyncio.sleep(0.05)
+                continue
+
+            from_block, to_block = claimed
+            started = time.monotonic()
+            try:
+                result_count = await process_window(from_block, to_block)
+            except Exception as e:
+                await asyncio.sleep(window.fail(from_block, to_block, e))
+                continue
+            window.complete(from_block, to_block, time.monotonic() - started, result_count)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
@@ -1,13 +1,14 @@
 import pandas as pd
 from openrank_sdk import EigenTrust
 import os
+from artifacts import read_artifact, write_artifact
 
 # Initialize EigenTrust. No API key needed.
 eigentrust = EigenTrust(api_key="")
 
 # Read the collector graph data
 print("Reading collector graph data...")
-df = pd.read_csv("collector_graph.csv")
+df = read_artifact("collector_graph.csv", columns=["from", "to", "value"])
 
 # Convert the data to the format expected by OpenRank
 print("Converting data to OpenRank format...")
@@ -30,10 +31,9 @@ rankings_df.columns = ["address", "score"]
 # Sort by score in descending order
 rankings_df = rankings_df.sort_values("score", ascending=False)
 
-# Save rankings to CSV
+# Save rankings to CSV and/or the columnar formats
 output_file = "eigentrust_rankings.csv"
-rankings_df.to_csv(output_file, index=False)
-print(f"Rankings saved to {output_file}")
+print(f"Rankings saved to {', '.join(write_artifact(rankings_df, output_file))}")
 
 # Print top 10 addresses by EigenTrust score
 print("\nTop 10 addresses by EigenTrust score:")
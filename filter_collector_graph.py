@@ -1,13 +1,13 @@
-import pandas as pd
+from artifacts import read_artifact, write_artifact
 
 def filter_self_edges(input_filename="collector_graph.csv", output_filename="collector_graph.csv"):
     """
-    Reads a collector graph CSV, removes rows where 'from' and 'to' are the same,
-    and saves the filtered data to a new CSV file.
+    Reads a collector graph, removes rows where 'from' and 'to' are the same,
+    and saves the filtered data in every ARTIFACT_FORMATS format.
     """
     try:
-        # Read the CSV file
-        df = pd.read_csv(input_filename)
+        # Read the graph from its first available format
+        df = read_artifact(input_filename)
         print(f"Read {len(df)} rows from {input_filename}")
 
         initial_rows = len(df)
@@ -17,8 +17,9 @@ def filter_self_edges(input_filename="collector_graph.csv", output_filename="col
         self_edges_removed = initial_rows - len(df_filtered_self)
         print(f"Removed {self_edges_removed} self-edges (where 'from' == 'to').")
 
-        # Filter out zero-value edges
-        df_filtered_value = df_filtered_self[df_filtered_self['value'] > 0].copy() # Use .copy()
+        # Filter out zero-value edges, on the exact wei amounts where the graph has them
+        value_column = 'value_wei' if 'value_wei' in df_filtered_self else 'value'
+        df_filtered_value = df_filtered_self[df_filtered_self[value_column] > 0].copy() # Use .copy()
         zero_value_removed = len(df_filtered_self) - len(df_filtered_value)
         print(f"Removed {zero_value_removed} zero-value edges (where 'value' == 0).")
 
@@ -28,14 +29,14 @@ def filter_self_edges(input_filename="collector_graph.csv", output_filename="col
         print(f"Total rows removed: {total_removed}")
         print(f"Writing {final_rows} rows to {output_filename}")
 
-        # Save the filtered DataFrame to a new CSV file
-        df_filtered_value.to_csv(output_filename, index=False)
-        print(f"Filtered graph saved to {output_filename}")
+        # Save the filtered DataFrame
+        written = write_artifact(df_filtered_value, output_filename)
+        print(f"Filtered graph saved to {', '.join(written)}")
 
     except FileNotFoundError:
         print(f"Error: Input file '{input_filename}' not found.")
     except KeyError as e:
-        print(f"Error: Missing expected column '{e}' in {input_filename}. Make sure the CSV has 'from' and 'to' columns.")
+        print(f"Error: Missing expected column '{e}' in {input_filename}. Make sure the graph has 'from' and 'to' columns.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
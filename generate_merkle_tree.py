@@ -1,9 +1,9 @@
-import csv
 import hashlib
 import json
-import os
 from typing import Dict, List, Tuple
 
+from artifacts import artifact_exists, read_artifact
+
 class MerkleTree:
     def __init__(self, leaves: List[Tuple[str, float]]):
         self.leaves = leaves
@@ -106,20 +106,19 @@ class MerkleTree:
 def main():
     # Check if input file exists
     input_file = "eigentrust_rankings.csv"
-    if not os.path.exists(input_file):
+    if not artifact_exists(input_file):
         print(f"Error: {input_file} not found")
         print("Please run compute_eigentrust.py first or specify a different input file")
         return
     
-    # Read the CSV file
+    # Read the rankings from their first available format
     print(f"Reading {input_file}...")
     addresses = []
-    with open(input_file, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # Convert score to float and round to 6 decimal places
-            amount = float(row['score'])
-            addresses.append((row['address'], amount))
+    df = read_artifact(input_file, columns=["address", "score"])
+    for address, score in zip(df["address"], df["score"]):
+        # Convert score to float and round to 6 decimal places
+        amount = float(score)
+        addresses.append((address, amount))
     
     # Create the Merkle tree
     print("Generating Merkle tree...")
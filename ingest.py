@@ -0,0 +1,826 @@
+from web3 import AsyncWeb3, Web3
+from web3.exceptions import ContractLogicError
+import argparse
+import asyncio
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from lens_abi import lens_hub_abi as LENS_HUB_ABI
+from artifacts import artifact_exists, check_artifact_formats, read_artifact
+from aggregators import METRICS, CollectorGraph, ProfileCollectorGraph, RecipientTotals, SignalGraph
+from block_scanner import (
+    AdaptiveWindow,
+    GapLedger,
+    ScanCheckpoint,
+    fetch_window_event_logs,
+    fetch_window_event_logs_async,
+    fetch_window_logs,
+    fetch_window_logs_async,
+    scan_blocks,
+    scan_blocks_async,
+    scan_blocks_pipelined,
+)
+from log_archive import ARCHIVE_CONFIRMATIONS, open_log_archive
+from owner_cache import open_owner_cache
+from ownership_index import open_ownership_index
+from rpc_pool import AsyncPooledHTTPProvider, EndpointPool, PooledHTTPProvider, rpc_urls
+
+# Connect to Polygon network; several comma-separated URLs are pooled and each request
+# goes to the healthiest endpoint. All RPC traffic is rate limited by the pool.
+POLYGON_RPC_URL = os.environ.get("POLYGON_RPC_URL")
+rpc_pool = EndpointPool(rpc_urls(POLYGON_RPC_URL))
+w3 = Web3(PooledHTTPProvider(rpc_pool))
+async_w3 = AsyncWeb3(AsyncPooledHTTPProvider(rpc_pool))
+
+# Contract address and ABI
+LENS_COLLECT = "0x0D90C58cBe787CD70B5Effe94Ce58185D72143fB"  # Collect Module
+BONSAI_TOKEN = "0x3d2bD0e15829AA5C362a4144FdF4A1112fa29B5c"  # Bonsai Token
+LENS_HUB_ADDRESS = "0xDb46d1Dc155634FbC732f92E853b10B288AD5a1d"
+
+# ABI for the Collected event
+COLLECTED_EVENT_ABI = {
+    "anonymous": False,
+    "inputs": [
+        {"indexed": True, "name": "collectedProfileId", "type": "uint256"},
+        {"indexed": True, "name": "collectedPubId", "type": "uint256"},
+        {"indexed": True, "name": "collectorProfileId", "type": "uint256"},
+        {"indexed": False, "name": "nftRecipient", "type": "address"},
+        {"indexed": False, "name": "collectActionData", "type": "bytes"},
+        {"indexed": False, "name": "collectActionResult", "type": "bytes"},
+        {"indexed": False, "name": "collectNFT", "type": "address"},
+        {"indexed": False, "name": "tokenId", "type": "uint256"},
+        {"indexed": False, "name": "transactionExecutor", "type": "address"},
+        {"indexed": False, "name": "timestamp", "type": "uint256"},
+    ],
+    "name": "Collected",
+    "type": "event",
+}
+
+# Multicall3 batches many ownerOf calls into one eth_call; empty disables batching
+MULTICALL3_ADDRESS = os.environ.get("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+# Maximum ownerOf calls per Multicall3 eth_call
+MULTICALL_BATCH_SIZE = int(os.environ.get("MULTICALL_BATCH_SIZE", "500"))
+
+# ABI for Multicall3.aggregate3
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"name": "target", "type": "address"},
+                    {"name": "allowFailure", "type": "bool"},
+                    {"name": "callData", "type": "bytes"},
+                ],
+                "name": "calls",
+                "type": "tuple[]",
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"name": "success", "type": "bool"},
+                    {"name": "returnData", "type": "bytes"},
+                ],
+                "name": "returnData",
+                "type": "tuple[]",
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function",
+    }
+]
+
+# Create contract instance
+contract = w3.eth.contract(address=LENS_COLLECT, abi=[COLLECTED_EVENT_ABI])
+lens_hub_contract = w3.eth.contract(address=LENS_HUB_ADDRESS, abi=LENS_HUB_ABI)
+async_contract = async_w3.eth.contract(address=LENS_COLLECT, abi=[COLLECTED_EVENT_ABI])
+async_lens_hub_contract = async_w3.eth.contract(address=LENS_HUB_ADDRESS, abi=LENS_HUB_ABI)
+if MULTICALL3_ADDRESS:
+    multicall_contract = w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+    async_multicall_contract = async_w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+
+# Start block
+START_BLOCK = 54264479
+# Initial block window; block_scanner grows or shrinks it as the scan goes
+BLOCK_INCREMENT = 10000
+
+# Block ranges that could not be fetched, kept for --repair
+GAP_LEDGER_FILE = "ingest_gaps.json"
+# Scanned block ranges, partial aggregates and owner cache, so later runs only scan new blocks
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+
+# Raw Collected logs already fetched, replayed from disk instead of RPC
+log_archive = open_log_archive()
+
+# Number of block windows kept in flight at once; 1 keeps the sequential scan
+SCAN_CONCURRENCY = int(os.environ.get("SCAN_CONCURRENCY", "1"))
+# Windows buffered between the fetch, decode, owner and aggregate stages of a sequential
+# scan, which run in their own threads; 0 runs each window through every stage in turn
+PIPELINE_DEPTH = int(os.environ.get("PIPELINE_DEPTH", "2"))
+# Worker processes the block range is sharded across; 1 scans in this process only
+SCAN_PROCESSES = int(os.environ.get("SCAN_PROCESSES", "1"))
+# Shards per worker process, so workers that finish early pick up the remaining shards
+SHARDS_PER_PROCESS = 4
+
+# Which owner collector graph edges point at: "at_collect" looks the owner up as of each
+# collect during the scan, "deferred" keys edges by profile id and maps them to current
+# owners in one batch when the graph is written
+GRAPH_OWNERS = os.environ.get("GRAPH_OWNERS", "at_collect")
+
+# Other LensHub events recorded as signal graphs in the same scan, e.g.
+# "Unfollowed,CollectNFTTransferred"; they share each window's eth_getLogs with Collected
+LENS_HUB_SIGNALS = [name for name in os.environ.get("LENS_HUB_SIGNALS", "").split(",") if name]
+# Event arguments each signal graph's edges go from and to, and its output file
+SIGNAL_GRAPHS = {
+    "Unfollowed": ("unfollowerProfileId", "idOfProfileUnfollowed", "unfollowed.csv"),
+    "CollectNFTTransferred": ("from", "to", "collect_nft_transferred.csv"),
+}
+
+# Cache for profile owner addresses to reduce RPC calls; None marks a profile whose
+# ownerOf reverts, so each unresolvable profile costs a single call
+profile_owner_cache = {}
+# Async owner lookups in flight by profile id, so concurrent windows needing the same
+# profile wait on one call instead of each making their own
+owner_lookups = {}
+# Owners resolved by earlier runs or other processes, backing profile_owner_cache on disk
+owner_cache = open_owner_cache()
+# Owner of every profile at any block, built from LensHub Transfer events
+ownership_index = open_ownership_index()
+
+# The fields of a Collected event the aggregators work with, decoded once per log
+Collect = namedtuple(
+    "Collect",
+    [
+        "nft_recipient",
+        "collected_profile_id",
+        "publication_id",
+        "collector_profile_id",
+        "token_address",
+        "amount",
+        "block_number",
+        "log_index",
+    ],
+)
+
+
+def load_cached_owners(profile_ids):
+    """Fill profile_owner_cache from the persistent owner cache; returns the profile ids
+    that are cached nowhere"""
+    unseen = [profile_id for profile_id in profile_ids if profile_id not in profile_owner_cache]
+    if owner_cache is not None and unseen:
+        profile_owner_cache.update(owner_cache.get_many(unseen))
+        unseen = [profile_id for profile_id in unseen if profile_id not in profile_owner_cache]
+    return unseen
+
+
+def store_owners(owners):
+    """Cache freshly resolved {profile_id: owner} answers in memory and on disk"""
+    profile_owner_cache.update(owners)
+    if owner_cache is not None:
+        owner_cache.put_many(owners)
+
+
+def get_owner_address(profile_id):
+    # Check if profile_id is in cache first, then in the persistent owner cache
+    if profile_id in profile_owner_cache or not load_cached_owners([profile_id]):
+        return profile_owner_cache[profile_id]
+
+    # If not in cache, make the contract call
+    try:
+        owner_address = lens_hub_contract.functions.ownerOf(profile_id).call()
+    except ContractLogicError as e:
+        print(f"Could not resolve the owner of profile {profile_id}, skipping its collects: {e}")
+        owner_address = None
+
+    # Store result in cache for future use
+    store_owners({profile_id: owner_address})
+
+    return owner_address
+
+
+def start_owner_lookup(profile_ids, lookup):
+    """Run an owner lookup coroutine as a task registered in owner_lookups for each of
+    its profile ids until it finishes"""
+    task = asyncio.ensure_future(lookup)
+    for profile_id in profile_ids:
+        owner_lookups[profile_id] = task
+
+    def forget(task):
+        for profile_id in profile_ids:
+            if owner_lookups.get(profile_id) is task:
+                del owner_lookups[profile_id]
+
+    task.add_done_callback(forget)
+    return task
+
+
+async def wait_owner_lookups(tasks):
+    # Shielded, so a window that is cancelled does not cancel a lookup others wait on
+    await asyncio.gather(*(asyncio.shield(task) for task in tasks))
+
+
+async def lookup_owner_async(profile_id):
+    """Async counterpart of the ownerOf call of get_owner_address, caching its answer"""
+    try:
+        owner_address = await async_lens_hub_contract.functions.ownerOf(profile_id).call()
+    except ContractLogicError as e:
+        print(f"Could not resolve the owner of profile {profile_id}, skipping its collects: {e}")
+        owner_address = None
+    store_owners({profile_id: owner_address})
+
+
+def owner_of_calls(profile_ids):
+    """Multicall3 aggregate3 calls for ownerOf of each profile id"""
+    return [
+        (LENS_HUB_ADDRESS, True, lens_hub_contract.encodeABI(fn_name="ownerOf", args=[profile_id]))
+        for profile_id in profile_ids
+    ]
+
+
+def cache_owner_results(profile_ids, results):
+    """Store successful aggregate3 ownerOf results; returns the profile ids that failed"""
+    owners = {}
+    failed = []
+    for profile_id, (success, return_data) in zip(profile_ids, results):
+        if success and len(return_data) == 32:
+            owners[profile_id] = w3.to_checksum_address(return_data[12:])
+        else:
+            failed.append(profile_id)
+    store_owners(owners)
+    return failed
+
+
+def resolve_owners(profile_ids):
+    """Resolve the owners of every profile id not cached in memory or on disk yet, one
+    Multicall3 eth_call per MULTICALL_BATCH_SIZE ids. Lookups that fail inside the batch
+    are retried on their own, so a revert is cached as unresolved and any other error
+    still fails the window."""
+    unseen = sorted(load_cached_owners(set(profile_ids)))
+    if not MULTICALL3_ADDRESS:
+        for profile_id in unseen:
+            get_owner_address(profile_id)
+        return
+
+    for i in range(0, len(unseen), MULTICALL_BATCH_SIZE):
+        batch = unseen[i:i + MULTICALL_BATCH_SIZE]
+        results = multicall_contract.functions.aggregate3(owner_of_calls(batch)).call()
+        for profile_id in cache_owner_results(batch, results):
+            get_owner_address(profile_id)
+
+
+async def lookup_owner_batch_async(profile_ids):
+    results = await async_multicall_contract.functions.aggregate3(owner_of_calls(profile_ids)).call()
+    for profile_id in cache_owner_results(profile_ids, results):
+        await lookup_owner_async(profile_id)
+
+
+async def resolve_owners_async(profile_ids):
+    """Async counterpart of resolve_owners. Profiles other windows are already looking
+    up are waited on, and this window's lookups are shared with them in turn."""
+    unseen = load_cached_owners(set(profile_ids))
+    tasks = {owner_lookups[profile_id] for profile_id in unseen if profile_id in owner_lookups}
+    unseen = sorted(profile_id for profile_id in unseen if profile_id not in owner_lookups)
+    if not MULTICALL3_ADDRESS:
+        tasks.update(start_owner_lookup([profile_id], lookup_owner_async(profile_id)) for profile_id in unseen)
+    else:
+        for i in range(0, len(unseen), MULTICALL_BATCH_SIZE):
+            batch = unseen[i:i + MULTICALL_BATCH_SIZE]
+            tasks.add(start_owner_lookup(batch, lookup_owner_batch_async(batch)))
+    await wait_owner_lookups(tasks)
+
+
+def owner_at(profile_id, block_number, log_index):
+    """Owner of a profile as of the log at (block_number, log_index), from the ownership
+    index; profiles it does not know fall back to their current owner, None if unresolved"""
+    if ownership_index is not None:
+        owner = ownership_index.owner_at(profile_id, block_number, log_index)
+        if owner is not None:
+            return owner
+    return get_owner_address(profile_id)
+
+
+def current_owners(profile_ids):
+    """{profile_id: current owner, None if unresolved} from the ownership index where it
+    knows the profile, and from batched ownerOf calls for the rest"""
+    owners = {}
+    if ownership_index is not None:
+        owners = {profile_id: ownership_index.current_owner(profile_id) for profile_id in profile_ids}
+        owners = {profile_id: owner for profile_id, owner in owners.items() if owner is not None}
+    rest = [profile_id for profile_id in profile_ids if profile_id not in owners]
+    resolve_owners(rest)
+    owners.update({profile_id: profile_owner_cache[profile_id] for profile_id in rest})
+    return owners
+
+
+def collector_graph(token, output_file="collector_graph.csv"):
+    """The collector graph aggregator GRAPH_OWNERS selects"""
+    if GRAPH_OWNERS == "deferred":
+        return ProfileCollectorGraph(token, current_owners, output_file=output_file)
+    return CollectorGraph(token, output_file=output_file)
+
+
+def owner_profile_ids(collects, aggregators):
+    """The collected profile ids whose current owner some aggregator needs because the
+    ownership index cannot answer for them"""
+    return {
+        collect.collected_profile_id
+        for collect in collects
+        if any(aggregator.wants_owner(collect) for aggregator in aggregators)
+        and (
+            ownership_index is None
+            or ownership_index.owner_at(collect.collected_profile_id, collect.block_number, collect.log_index) is None
+        )
+    }
+
+
+def decode_collect_log(log, tokens):
+    """Decode the fields of a raw Collected log the aggregators need, straight from its
+    data bytes. Returns None for collects paid in a token not in `tokens` (20-byte
+    addresses) without building any Python objects for them."""
+    data = memoryview(log["data"])
+
+    # collectActionData is abi.encode(token, amount), found through its head offset
+    offset = int.from_bytes(data[32:64], "big")
+    length = int.from_bytes(data[offset:offset + 32], "big")
+    collect_action_data = data[offset + 32:offset + 32 + length]
+    token = collect_action_data[12:32]
+    if token not in tokens:
+        return None
+
+    topics = log["topics"]
+    return Collect(
+        nft_recipient=bytes(data[12:32]),
+        collected_profile_id=int.from_bytes(topics[1], "big"),
+        publication_id=int.from_bytes(topics[2], "big"),
+        collector_profile_id=int.from_bytes(topics[3], "big"),
+        token_address=bytes(token),
+        amount=int.from_bytes(collect_action_data[32:], "big"),
+        block_number=log["blockNumber"],
+        log_index=log["logIndex"],
+    )
+
+
+def unique_logs(logs):
+    """The logs of a window with repeats dropped, keyed by (transactionHash, logIndex)"""
+    seen = set()
+    for log in logs:
+        key = (bytes(log["transactionHash"]), log["logIndex"])
+        if key not in seen:
+            seen.add(key)
+            yield log
+
+
+def decode_collects(logs, aggregators):
+    """Decode the raw logs of a window into Collects, dropping tokens no aggregator uses.
+    A log repeated in the window is decoded once."""
+    tokens = {aggregator.token_address for aggregator in aggregators}
+    collects = []
+    for log in unique_logs(logs):
+        collect = decode_collect_log(log, tokens)
+        if collect is not None:
+            collects.append(collect)
+    return collects
+
+
+def subscribed_events(aggregators):
+    """Names of the events the aggregators consume, each fetched once per window"""
+    return sorted({aggregator.event for aggregator in aggregators})
+
+
+def contract_event(name, use_async=False):
+    """Contract event for an event name: Collected from the collect module, any other
+    event from the LensHub"""
+    if name == "Collected":
+        source = async_contract if use_async else contract
+    else:
+        source = async_lens_hub_contract if use_async else lens_hub_contract
+    return getattr(source.events, name)()
+
+
+def decode_events(logs_by_event, aggregators):
+    """Decode the raw logs of a window per event name: Collects for Collected, web3
+    event data for the other events"""
+    events = {}
+    for name, logs in logs_by_event.items():
+        if name == "Collected":
+            events[name] = decode_collects(logs, [aggregator for aggregator in aggregators if aggregator.event == name])
+        else:
+            decoder = contract_event(name)
+            events[name] = [decoder.process_log(log) for log in unique_logs(logs)]
+    return events
+
+
+def apply_events(events, aggregators):
+    """Feed every decoded event of a window to a partial aggregate of each aggregator
+    consuming it, then merge the partials in. A window that fails partway leaves the
+    aggregators untouched, so its retry cannot count any event twice."""
+    partials = [aggregator.partial() for aggregator in aggregators]
+    for partial in partials:
+        for event in events[partial.event]:
+            partial.add(event, owner_at)
+
+    # Commit the window
+    for aggregator, partial in zip(aggregators, partials):
+        aggregator.merge_state(partial.state())
+
+
+def print_found(logs_by_event, from_block, to_block):
+    found = ", ".join(f"{len(logs)} {name}" for name, logs in logs_by_event.items())
+    print(f"Found {found} events in blocks {from_block} to {to_block}")
+
+
+def fetch_events(from_block, to_block, aggregators):
+    """Fetch the raw logs of every event the aggregators consume in one eth_getLogs per
+    block range, as {event name: logs}"""
+    print(f"Processing blocks {from_block} to {to_block}...")
+
+    # Get all events in this block range
+    names = subscribed_events(aggregators)
+    logs = fetch_window_event_logs([contract_event(name) for name in names], from_block, to_block, log_archive)
+    logs_by_event = dict(zip(names, logs))
+    print_found(logs_by_event, from_block, to_block)
+    return logs_by_event
+
+
+def process_block_range(from_block, to_block, aggregators):
+    """Process a range of blocks and update every aggregator.
+    Returns the number of events found; errors are left to the block scanner."""
+    logs_by_event = fetch_events(from_block, to_block, aggregators)
+    events = decode_events(logs_by_event, aggregators)
+
+    # Resolve the owners the ownership index cannot answer for in one batched call
+    resolve_owners(owner_profile_ids(events.get("Collected", []), aggregators))
+
+    apply_events(events, aggregators)
+
+    return sum(len(logs) for logs in logs_by_event.values())
+
+
+async def process_block_range_async(from_block, to_block, aggregators):
+    """Async counterpart of process_block_range using AsyncWeb3"""
+    print(f"Processing blocks {from_block} to {to_block}...")
+
+    names = subscribed_events(aggregators)
+    logs = await fetch_window_event_logs_async(
+        [contract_event(name, use_async=True) for name in names], from_block, to_block, log_archive
+    )
+    logs_by_event = dict(zip(names, logs))
+    print_found(logs_by_event, from_block, to_block)
+    events = decode_events(logs_by_event, aggregators)
+
+    # Resolve every owner the index cannot answer for up front so apply_events only hits the cache
+    await resolve_owners_async(owner_profile_ids(events.get("Collected", []), aggregators))
+
+    # No awaits below this point, so concurrent windows never interleave their updates
+    apply_events(events, aggregators)
+    return sum(len(logs) for logs in logs_by_event.values())
+
+
+def event_stages(aggregators):
+    """process_block_range split into pipeline stages: fetch, decode, resolve owners and
+    aggregate. Only the last stage touches the aggregators."""
+
+    def fetch(from_block, to_block):
+        return fetch_events(from_block, to_block, aggregators)
+
+    def decode(logs_by_event):
+        return sum(len(logs) for logs in logs_by_event.values()), decode_events(logs_by_event, aggregators)
+
+    def resolve(decoded):
+        resolve_owners(owner_profile_ids(decoded[1].get("Collected", []), aggregators))
+        return decoded
+
+    def aggregate(decoded):
+        log_count, events = decoded
+        apply_events(events, aggregators)
+        return log_count
+
+    return [fetch, decode, resolve, aggregate]
+
+
+async def scan_windows_async(windows, process_window_async):
+    """Scan every block window with SCAN_CONCURRENCY windows in flight"""
+    try:
+        for window in windows:
+            await scan_blocks_async(window, process_window_async, SCAN_CONCURRENCY)
+    finally:
+        # The lean transport's aiohttp sessions are bound to this event loop
+        await async_w3.provider.close_lean_sessions()
+
+
+def scan_windows(windows, process_window, process_window_async, stages):
+    """Run every block window of a list of AdaptiveWindows through process_window, through
+    the coroutine process_window_async when SCAN_CONCURRENCY > 1, or through the same
+    work split into pipelined stages when PIPELINE_DEPTH > 0"""
+    if SCAN_CONCURRENCY > 1:
+        print(f"Scanning with {SCAN_CONCURRENCY} concurrent block windows")
+        asyncio.run(scan_windows_async(windows, process_window_async))
+    elif PIPELINE_DEPTH > 0:
+        for window in windows:
+            scan_blocks_pipelined(window, stages, PIPELINE_DEPTH)
+    else:
+        for window in windows:
+            scan_blocks(window, process_window)
+
+
+def scan(windows, aggregators):
+    """Process every block window of a list of AdaptiveWindows into the aggregators"""
+    scan_windows(
+        windows,
+        lambda from_block, to_block: process_block_range(from_block, to_block, aggregators),
+        lambda from_block, to_block: process_block_range_async(from_block, to_block, aggregators),
+        event_stages(aggregators),
+    )
+    return aggregators
+
+
+def shard_ranges(ranges, shard_count):
+    """Split block ranges into about shard_count shards of similar size, in block order"""
+    total_blocks = sum(to_block - from_block + 1 for from_block, to_block in ranges)
+    shard_size = max(-(-total_blocks // shard_count), BLOCK_INCREMENT)
+    return [
+        (start, min(start + shard_size - 1, to_block))
+        for from_block, to_block in ranges
+        for start in range(from_block, to_block + 1, shard_size)
+    ]
+
+
+def init_shard_worker(current_block):
+    set_head(current_block)
+
+
+def scan_shard(from_block, to_block, aggregators):
+    """Scan one shard in a worker process into empty aggregators. Returns their states,
+    the owners this shard resolved and the block ranges it skipped."""
+    known_owners = set(profile_owner_cache)
+    window = AdaptiveWindow(from_block, to_block, BLOCK_INCREMENT)
+    scan([window], aggregators)
+    owners = {
+        profile_id: owner for profile_id, owner in profile_owner_cache.items() if profile_id not in known_owners
+    }
+    return [aggregator.state() for aggregator in aggregators], owners, window.skipped
+
+
+def scan_sharded(ranges, aggregators, current_block, gap_ledger, checkpoint):
+    """Map-reduce the scan of the block ranges over SCAN_PROCESSES worker processes. Each
+    shard is scanned into partial aggregates by a worker. The partials are merged here in
+    block order, so the outputs do not depend on which worker finishes first."""
+    shards = shard_ranges(ranges, SCAN_PROCESSES * SHARDS_PER_PROCESS)
+    if not shards:
+        return
+    print(f"Scanning {len(shards)} block shards in {SCAN_PROCESSES} processes")
+
+    # Spawned workers open their own RPC sessions and SQLite connections
+    with ProcessPoolExecutor(
+        SCAN_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_shard_worker,
+        initargs=(current_block,),
+    ) as executor:
+        from_blocks, to_blocks = zip(*shards)
+        partials = [[aggregator.partial() for aggregator in aggregators] for _ in shards]
+        results = executor.map(scan_shard, from_blocks, to_blocks, partials)
+        for (from_block, to_block), (states, owners, skipped) in zip(shards, results):
+            for aggregator, state in zip(aggregators, states):
+                aggregator.merge_state(state)
+            profile_owner_cache.update(owners)
+            for gap in skipped:
+                gap_ledger.record(gap["from_block"], gap["to_block"], gap["error"])
+            # Skipped ranges are accounted for by the gap ledger, as in a single-process scan
+            checkpoint.mark_scanned(from_block, to_block)
+            checkpoint.maybe_save()
+
+
+def fetch_transfer_logs(from_block, to_block):
+    return fetch_window_logs(lens_hub_contract.events.Transfer(), from_block, to_block, log_archive)
+
+
+def index_transfer_logs(logs):
+    ownership_index.add_transfer_logs(logs)
+    return len(logs)
+
+
+def index_transfer_range(from_block, to_block):
+    """Add the LensHub Transfer events of a block range to the ownership index"""
+    return index_transfer_logs(fetch_transfer_logs(from_block, to_block))
+
+
+async def index_transfer_range_async(from_block, to_block):
+    """Async counterpart of index_transfer_range"""
+    logs = await fetch_window_logs_async(async_lens_hub_contract.events.Transfer(), from_block, to_block, log_archive)
+    ownership_index.add_transfer_logs(logs)
+    return len(logs)
+
+
+def update_ownership_index(end_block, aggregators):
+    """Index the profile Transfer events of every block up to end_block not indexed yet,
+    if some aggregator looks up profile owners"""
+    if ownership_index is None or not any(aggregator.needs_owners for aggregator in aggregators):
+        return
+
+    missing_ranges = ownership_index.missing_ranges(end_block)
+    if not missing_ranges:
+        return
+    print(f"Indexing profile transfers in {len(missing_ranges)} block ranges...")
+    windows = [
+        AdaptiveWindow(from_block, to_block, BLOCK_INCREMENT, checkpoint=ownership_index.checkpoint)
+        for from_block, to_block in missing_ranges
+    ]
+    scan_windows(windows, index_transfer_range, index_transfer_range_async, [fetch_transfer_logs, index_transfer_logs])
+    ownership_index.checkpoint.save()
+
+    skipped = [skipped for window in windows for skipped in window.skipped]
+    if skipped:
+        # Owners read from an index with holes would be silently wrong
+        raise SystemExit(
+            f"{len(skipped)} block ranges of profile transfers could not be indexed; rerun to retry them "
+            "(indexed ranges are kept), or set OWNERSHIP_INDEX_FILE= to look owners up over RPC instead"
+        )
+
+
+def checkpoint_state(aggregators):
+    """JSON-serializable scan state saved in the checkpoint file"""
+    return {
+        "aggregates": {aggregator.name: aggregator.state() for aggregator in aggregators},
+        # Copied first, as the owner stage of a pipelined scan may be adding to it
+        "profile_owner_cache": {str(profile_id): owner for profile_id, owner in profile_owner_cache.copy().items()},
+    }
+
+
+def restore_checkpoint_state(state, aggregators):
+    """Load a checkpoint_state() back into the aggregators and profile_owner_cache"""
+    for aggregator in aggregators:
+        if aggregator.name not in state["aggregates"]:
+            raise SystemExit(f"The checkpoint has no {aggregator.name} aggregate (were --token, --metric, GRAPH_OWNERS or LENS_HUB_SIGNALS changed?); rerun with --full")
+        aggregator.merge_state(state["aggregates"][aggregator.name])
+    profile_owner_cache.update({int(profile_id): owner for profile_id, owner in state["profile_owner_cache"].items()})
+
+
+def set_head(current_block):
+    """Tell the on-disk stores which block this run reads the chain at"""
+    if log_archive is not None:
+        log_archive.set_head(current_block)
+    if owner_cache is not None:
+        owner_cache.set_head(current_block)
+
+
+def spill_dir(checkpoint_file):
+    """Directory the collector graphs of a scanner spill their runs to, next to its checkpoint"""
+    return os.path.splitext(checkpoint_file)[0] + "_runs"
+
+
+def prune_spilled_runs(directory, aggregators):
+    """Delete the spilled runs no aggregator refers to. Called once the checkpoint has been
+    saved from the aggregators, this drops runs merged into bigger ones, the transient runs
+    of deferred wallet graphs and those of checkpoints replaced by a --full rescan."""
+    if not os.path.isdir(directory):
+        return
+    referenced = {os.path.normpath(path) for aggregator in aggregators for path in getattr(aggregator, "runs", ())}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.normpath(path) not in referenced:
+            os.remove(path)
+
+
+def repair(aggregators, checkpoint_file, gap_ledger_file):
+    """Re-fetch only the block ranges recorded in the gap ledger and merge them into the outputs"""
+    gap_ledger = GapLedger(gap_ledger_file)
+    if not gap_ledger.gaps:
+        print(f"No skipped block ranges recorded in {gap_ledger_file}")
+        return
+
+    print(f"Re-fetching {len(gap_ledger.gaps)} skipped block ranges...")
+    current_block = w3.eth.block_number
+    set_head(current_block)
+    update_ownership_index(current_block - ARCHIVE_CONFIRMATIONS, aggregators)
+    windows = [AdaptiveWindow(gap["from_block"], gap["to_block"], BLOCK_INCREMENT) for gap in gap_ledger.gaps]
+    scan(windows, aggregators)
+    still_missing = [skipped for window in windows for skipped in window.skipped]
+
+    checkpoint = ScanCheckpoint(checkpoint_file, lambda: checkpoint_state(aggregators))
+    if checkpoint.state is not None:
+        # Merge into the exact wei values of the checkpoint and rewrite the outputs from them
+        restore_checkpoint_state(checkpoint.state, aggregators)
+        checkpoint.save()
+        for aggregator in aggregators:
+            aggregator.write_results()
+        prune_spilled_runs(spill_dir(checkpoint_file), aggregators)
+    else:
+        for aggregator in aggregators:
+            if not aggregator.state():
+                continue
+            df = aggregator.to_dataframe()
+            if artifact_exists(aggregator.output_file):
+                df = aggregator.combine_frames(read_artifact(aggregator.output_file), df)
+            aggregator.save_results(df)
+        # Without a checkpoint nothing refers to the runs once the outputs are written
+        prune_spilled_runs(spill_dir(checkpoint_file), [])
+
+    # Only forget the gaps once their events have been merged
+    gap_ledger.replace(still_missing)
+    print(f"{len(still_missing)} block ranges still missing")
+
+
+def signal_graphs():
+    """A SignalGraph for every event in LENS_HUB_SIGNALS"""
+    unknown = [name for name in LENS_HUB_SIGNALS if name not in SIGNAL_GRAPHS]
+    if unknown:
+        raise SystemExit(f"Unknown LENS_HUB_SIGNALS {', '.join(unknown)}; choose from {', '.join(SIGNAL_GRAPHS)}")
+    return [SignalGraph(name, *SIGNAL_GRAPHS[name]) for name in LENS_HUB_SIGNALS]
+
+
+def parse_token(value):
+    """A --token value, "label=address" or just an address, as (label, address)"""
+    label, _, address = value.rpartition("=")
+    return label or address.lower(), address
+
+
+def aggregator_variants(aggregators, tokens, metrics):
+    """Every aggregator for every (label, address) token and every metric, from one scan"""
+    return [
+        aggregator.variant(address, label, metric)
+        for aggregator in aggregators
+        for label, address in tokens
+        for metric in metrics
+    ]
+
+
+def run(aggregators, checkpoint_file=CHECKPOINT_FILE, gap_ledger_file=GAP_LEDGER_FILE, description=None):
+    """Command line entry point: scan Collected events once into every aggregator and
+    write each aggregator's output"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--repair", action="store_true", help=f"only re-fetch the block ranges recorded in {gap_ledger_file}")
+    parser.add_argument("--full", action="store_true", help=f"ignore {checkpoint_file} and rescan from START_BLOCK")
+    parser.add_argument(
+        "--token",
+        type=parse_token,
+        action="append",
+        help="token to aggregate as label=address or address (repeatable, default Bonsai)",
+    )
+    parser.add_argument("--metric", choices=METRICS, action="append", help="metric to aggregate (repeatable, default amount)")
+    args = parser.parse_args()
+
+    # Every token and metric is aggregated from the same scan, each into its own output
+    if args.token or args.metric:
+        tokens = args.token or [("bonsai", BONSAI_TOKEN)]
+        aggregators = aggregator_variants(aggregators, tokens, args.metric or ["amount"])
+    aggregators = aggregators + signal_graphs()
+    check_artifact_formats()
+    for aggregator in aggregators:
+        if isinstance(aggregator, CollectorGraph):
+            aggregator.spill_dir = spill_dir(checkpoint_file)
+
+    if args.repair:
+        repair(aggregators, checkpoint_file, gap_ledger_file)
+        return
+
+    print("Starting to fetch Collected events...")
+
+    # Get current block number
+    current_block = w3.eth.block_number
+    print(f"Current block: {current_block}")
+    set_head(current_block)
+    # Blocks this close to the head may still be reorged, so they are left to a later run
+    # rather than committed to the checkpoint and the ownership index
+    safe_block = current_block - ARCHIVE_CONFIRMATIONS
+    update_ownership_index(safe_block, aggregators)
+
+    # Resume from the last checkpoint so only blocks not scanned yet are fetched
+    checkpoint = ScanCheckpoint(checkpoint_file, lambda: checkpoint_state(aggregators))
+    gap_ledger = GapLedger(gap_ledger_file)
+    if args.full:
+        checkpoint.reset()
+    if checkpoint.state is None:
+        gap_ledger.clear()
+    else:
+        restore_checkpoint_state(checkpoint.state, aggregators)
+
+    # Process blocks in adaptively sized windows, recording skipped ranges for --repair
+    missing_ranges = checkpoint.missing_ranges(START_BLOCK, safe_block)
+    if checkpoint.state is not None:
+        print(f"Resuming from checkpoint, scanning {len(missing_ranges)} missing block ranges up to block {safe_block}")
+    if SCAN_PROCESSES > 1:
+        scan_sharded(missing_ranges, aggregators, current_block, gap_ledger, checkpoint)
+    else:
+        windows = [
+            AdaptiveWindow(from_block, to_block, BLOCK_INCREMENT, gap_ledger=gap_ledger, checkpoint=checkpoint)
+            for from_block, to_block in missing_ranges
+        ]
+        scan(windows, aggregators)
+    checkpoint.save()
+
+    if gap_ledger.gaps:
+        print(f"{len(gap_ledger.gaps)} block ranges were skipped; run with --repair to fetch them")
+
+    for aggregator in aggregators:
+        aggregator.write_results()
+    prune_spilled_runs(spill_dir(checkpoint_file), aggregators)
+
+
+if __name__ == "__main__":
+    run(
+        [RecipientTotals(BONSAI_TOKEN), collector_graph(BONSAI_TOKEN)],
+        description="Build bonsai_collectors.csv and collector_graph.csv in a single scan of Collected events",
+    )
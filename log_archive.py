@@ -0,0 +1,147 @@
+import os
+import sqlite3
+
+from hexbytes import HexBytes
+
+# SQLite file holding raw logs already fetched from RPC; empty disables the archive
+LOG_ARCHIVE_FILE = os.environ.get("LOG_ARCHIVE_FILE", "collected_logs.sqlite")
+# Blocks this close to the head may still be reorged, so they are never marked as archived
+ARCHIVE_CONFIRMATIONS = int(os.environ.get("ARCHIVE_CONFIRMATIONS", "128"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    address TEXT NOT NULL,
+    topic0 TEXT NOT NULL,
+    from_block INTEGER NOT NULL,
+    to_block INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_by_subscription ON segments (address, topic0, from_block);
+CREATE TABLE IF NOT EXISTS logs (
+    address TEXT NOT NULL,
+    topic0 TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    transaction_index INTEGER NOT NULL,
+    transaction_hash BLOB NOT NULL,
+    block_hash BLOB NOT NULL,
+    topics BLOB NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (address, topic0, block_number, log_index)
+) WITHOUT ROWID;
+"""
+
+
+class LogArchive:
+    """Local archive of raw logs, segmented by the block ranges that have been fetched
+    for each (address, topic0) subscription"""
+
+    def __init__(self, path):
+        self.path = path
+        # Highest block that may be recorded as archived, see set_head()
+        self.safe_block = None
+        # WAL lets the worker processes of a sharded scan share the archive, and the fetch
+        # stage of a pipelined scan uses it from its own thread
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def set_head(self, current_block):
+        self.safe_block = current_block - ARCHIVE_CONFIRMATIONS
+
+    def segments(self, address, topic0):
+        rows = self.connection.execute(
+            "SELECT from_block, to_block FROM segments WHERE address = ? AND topic0 = ? ORDER BY from_block",
+            (address.lower(), topic0),
+        )
+        return [list(row) for row in rows]
+
+    def plan(self, address, topic0, from_block, to_block):
+        """Split from_block..to_block into (start, end, archived) pieces, in block order"""
+        pieces = []
+        cursor = from_block
+        for start, end in self.segments(address, topic0):
+            if end < cursor:
+                continue
+            if start > to_block:
+                break
+            if start > cursor:
+                pieces.append((cursor, start - 1, False))
+            pieces.append((max(start, cursor), min(end, to_block), True))
+            cursor = end + 1
+            if cursor > to_block:
+                break
+        if cursor <= to_block:
+            pieces.append((cursor, to_block, False))
+        return pieces
+
+    def read(self, address, topic0, from_block, to_block):
+        """Return the archived logs of from_block..to_block as raw log dicts"""
+        rows = self.connection.execute(
+            "SELECT block_number, log_index, transaction_index, transaction_hash, block_hash, topics, data "
+            "FROM logs WHERE address = ? AND topic0 = ? AND block_number BETWEEN ? AND ? "
+            "ORDER BY block_number, log_index",
+            (address.lower(), topic0, from_block, to_block),
+        )
+        return [
+            {
+                "address": address,
+                "blockNumber": block_number,
+                "logIndex": log_index,
+                "transactionIndex": transaction_index,
+                "transactionHash": HexBytes(transaction_hash),
+                "blockHash": HexBytes(block_hash),
+                "topics": [HexBytes(topics[i:i + 32]) for i in range(0, len(topics), 32)],
+                "data": HexBytes(data),
+                "removed": False,
+            }
+            for block_number, log_index, transaction_index, transaction_hash, block_hash, topics, data in rows
+        ]
+
+    def store(self, address, topic0, from_block, to_block, logs):
+        """Archive the logs fetched for from_block..to_block, up to safe_block"""
+        if self.safe_block is not None:
+            to_block = min(to_block, self.safe_block)
+        if to_block < from_block:
+            return
+
+        rows = [
+            (
+                address.lower(),
+                topic0,
+                log["blockNumber"],
+                log["logIndex"],
+                log["transactionIndex"],
+                bytes(HexBytes(log["transactionHash"])),
+                bytes(HexBytes(log["blockHash"])),
+                b"".join(bytes(HexBytes(topic)) for topic in log["topics"]),
+                bytes(HexBytes(log["data"])),
+            )
+            for log in logs
+            if log["blockNumber"] <= to_block
+        ]
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO logs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._add_segment(address.lower(), topic0, from_block, to_block)
+
+    def _add_segment(self, address, topic0, from_block, to_block):
+        # Merge with any touching or overlapping segment so plan() stays short
+        overlapping = self.connection.execute(
+            "SELECT from_block, to_block FROM segments "
+            "WHERE address = ? AND topic0 = ? AND from_block <= ? AND to_block >= ?",
+            (address, topic0, to_block + 1, from_block - 1),
+        ).fetchall()
+        for start, end in overlapping:
+            from_block = min(from_block, start)
+            to_block = max(to_block, end)
+        self.connection.execute(
+            "DELETE FROM segments WHERE address = ? AND topic0 = ? AND from_block >= ? AND to_block <= ?",
+            (address, topic0, from_block, to_block),
+        )
+        self.connection.execute("INSERT INTO segments VALUES (?, ?, ?, ?)", (address, topic0, from_block, to_block))
+
+
+def open_log_archive():
+    """Open LOG_ARCHIVE_FILE, or return None if the archive is disabled"""
+    if not LOG_ARCHIVE_FILE:
+        return None
+    return LogArchive(LOG_ARCHIVE_FILE)
@@ -0,0 +1,121 @@
+import argparse
+import os
+import sqlite3
+
+# SQLite file shared by every scanner process; empty disables the persistent cache
+OWNER_CACHE_FILE = os.environ.get("OWNER_CACHE_FILE", "profile_owners.sqlite")
+
+# Keep IN (...) lists under SQLite's bound-parameter limit
+QUERY_CHUNK_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS owners (
+    profile_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    observed_block INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS owners_by_block ON owners (observed_block);
+CREATE TABLE IF NOT EXISTS unresolved (
+    profile_id TEXT PRIMARY KEY,
+    observed_block INTEGER NOT NULL
+);
+"""
+
+
+class OwnerCache:
+    """Disk-backed profile id -> owner cache that survives restarts. Each answer keeps the
+    block it was observed at so stale entries can be invalidated selectively. Profiles
+    whose ownerOf reverts (e.g. burned profiles) are cached with a None owner. WAL mode
+    lets several scanner processes read while one of them writes."""
+
+    def __init__(self, path):
+        self.path = path
+        # Block that new answers are recorded as observed at, see set_head()
+        self.observed_block = 0
+        # The owner stage of a pipelined scan uses the cache from its own thread
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def set_head(self, current_block):
+        self.observed_block = current_block
+
+    def get_many(self, profile_ids):
+        """Return {profile_id: owner} for the profile ids that are cached, with a None
+        owner for unresolved ones"""
+        profile_ids = [str(profile_id) for profile_id in profile_ids]
+        owners = {}
+        for i in range(0, len(profile_ids), QUERY_CHUNK_SIZE):
+            chunk = profile_ids[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT profile_id, owner FROM owners WHERE profile_id IN ({placeholders}) "
+                f"UNION ALL SELECT profile_id, NULL FROM unresolved WHERE profile_id IN ({placeholders})",
+                chunk + chunk,
+            )
+            owners.update({int(profile_id): owner for profile_id, owner in rows})
+        return owners
+
+    def put_many(self, owners):
+        """Record {profile_id: owner} answers as observed at observed_block; a None owner
+        records the profile as unresolved"""
+        if not owners:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO owners VALUES (?, ?, ?)",
+                [(str(profile_id), owner, self.observed_block) for profile_id, owner in owners.items() if owner is not None],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO unresolved VALUES (?, ?)",
+                [(str(profile_id), self.observed_block) for profile_id, owner in owners.items() if owner is None],
+            )
+
+    def invalidate(self, profile_ids=None, before_block=None):
+        """Drop the given profile ids and/or every answer observed before before_block.
+        Returns the number of entries removed."""
+        removed = 0
+        with self.connection:
+            if profile_ids:
+                profile_ids = [str(profile_id) for profile_id in profile_ids]
+                for i in range(0, len(profile_ids), QUERY_CHUNK_SIZE):
+                    chunk = profile_ids[i:i + QUERY_CHUNK_SIZE]
+                    for table in ("owners", "unresolved"):
+                        removed += self.connection.execute(
+                            f"DELETE FROM {table} WHERE profile_id IN ({', '.join('?' * len(chunk))})", chunk
+                        ).rowcount
+            if before_block is not None:
+                for table in ("owners", "unresolved"):
+                    removed += self.connection.execute(
+                        f"DELETE FROM {table} WHERE observed_block < ?", (before_block,)
+                    ).rowcount
+        return removed
+
+
+def open_owner_cache():
+    """Open OWNER_CACHE_FILE, or return None if the persistent cache is disabled"""
+    if not OWNER_CACHE_FILE:
+        return None
+    return OwnerCache(OWNER_CACHE_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Invalidate entries of the profile owner cache in {OWNER_CACHE_FILE}")
+    parser.add_argument("--profile-id", type=int, action="append", default=[], help="profile id to drop (repeatable)")
+    parser.add_argument("--before-block", type=int, help="drop every answer observed before this block")
+    args = parser.parse_args()
+
+    if not args.profile_id and args.before_block is None:
+        parser.error("nothing to invalidate; pass --profile-id and/or --before-block")
+
+    owner_cache = open_owner_cache()
+    if owner_cache is None:
+        print("The persistent owner cache is disabled (OWNER_CACHE_FILE is empty)")
+        return
+
+    removed = owner_cache.invalidate(profile_ids=args.profile_id, before_block=args.before_block)
+    print(f"Removed {removed} cached owners from {OWNER_CACHE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+from bisect import bisect_left, insort
+
+from block_scanner import ScanCheckpoint
+
+# Block the LensHub proxy was deployed at; every profile Transfer happens after it
+LENS_HUB_START_BLOCK = 28384641
+# Profile Transfer history and the block ranges it covers; empty disables the index
+OWNERSHIP_INDEX_FILE = os.environ.get("OWNERSHIP_INDEX_FILE", "ownership_index.json")
+
+
+class OwnershipIndex:
+    """Owner of every Lens profile at any block, replayed from LensHub Transfer events.
+    The history is saved with the block ranges it was built from, so later runs only
+    scan Transfer events in new blocks."""
+
+    def __init__(self, path):
+        # profile_id -> [(block_number, log_index, owner), ...] in chain order
+        self.history = {}
+        self.checkpoint = ScanCheckpoint(path, self.state)
+        if self.checkpoint.state is not None:
+            for profile_id, transfers in self.checkpoint.state["history"].items():
+                # Owners are saved as hex and kept as raw bytes
+                self.history[int(profile_id)] = [
+                    (block_number, log_index, bytes.fromhex(owner[2:])) for block_number, log_index, owner in transfers
+                ]
+
+    def state(self):
+        return {"history": {str(profile_id): transfers for profile_id, transfers in self.history.items()}}
+
+    def missing_ranges(self, end_block):
+        """Block ranges up to end_block whose Transfer events are not indexed yet"""
+        return self.checkpoint.missing_ranges(LENS_HUB_START_BLOCK, end_block)
+
+    def add_transfer_logs(self, logs):
+        """Index raw Transfer(from, to, tokenId) logs, all three arguments being topics"""
+        for log in logs:
+            topics = log["topics"]
+            if len(topics) != 4:
+                continue
+            profile_id = int.from_bytes(topics[3], "big")
+            owner = bytes(topics[2][12:])
+            # Windows may finish out of order, so keep each history sorted
+            insort(self.history.setdefault(profile_id, []), (log["blockNumber"], log["logIndex"], owner))
+
+    def owner_at(self, profile_id, block_number, log_index):
+        """Owner of a profile just before the log at (block_number, log_index), as 20 raw
+        bytes, or None if the profile had not been minted or had been burned by then"""
+        transfers = self.history.get(profile_id)
+        if not transfers:
+            return None
+        i = bisect_left(transfers, (block_number, log_index))
+        if i == 0 or not any(transfers[i - 1][2]):
+            return None
+        return transfers[i - 1][2]
+
+    def current_owner(self, profile_id):
+        """Owner of a profile after every indexed transfer, as 20 raw bytes, or None if it
+        is unknown or burned"""
+        transfers = self.history.get(profile_id)
+        if not transfers or not any(transfers[-1][2]):
+            return None
+        return transfers[-1][2]
+
+
+def open_ownership_index():
+    """Open OWNERSHIP_INDEX_FILE, or return None if the ownership index is disabled"""
+    if not OWNERSHIP_INDEX_FILE:
+        return None
+    return OwnershipIndex(OWNERSHIP_INDEX_FILE)
@@ -0,0 +1,592 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import aiohttp
+import requests
+from web3 import AsyncHTTPProvider, HTTPProvider
+from web3.providers import JSONBaseProvider
+from web3.providers.async_base import AsyncJSONBaseProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Methods fired a second time on another endpoint once they pass their p95 latency
+HEDGED_METHODS = ("eth_getLogs", "eth_call")
+# Latency samples kept per endpoint and method
+LATENCY_SAMPLES = int(os.environ.get("RPC_LATENCY_SAMPLES", "100"))
+# Samples needed before an endpoint's p95 is trusted for hedging
+HEDGE_MIN_SAMPLES = int(os.environ.get("RPC_HEDGE_MIN_SAMPLES", "20"))
+# Share of requests sent to a random endpoint so recovered endpoints get measured again
+EXPLORE_RATE = float(os.environ.get("RPC_EXPLORE_RATE", "0.05"))
+# Weight of each new outcome in an endpoint's moving error rate
+ERROR_DECAY = 0.1
+# How much an endpoint's error rate inflates its latency score
+ERROR_PENALTY = 10
+# Filter methods bound to the endpoint that created the filter
+FILTER_METHODS = ("eth_getFilterLogs", "eth_getFilterChanges", "eth_uninstallFilter")
+
+# Request budget per endpoint in cost units per second (see RPC_METHOD_COSTS); 0 is unlimited
+RPC_RATE_LIMIT = float(os.environ.get("RPC_RATE_LIMIT", "0"))
+# Cost units an endpoint may spend at once after being idle
+RPC_BURST = float(os.environ.get("RPC_BURST", "0")) or RPC_RATE_LIMIT
+# Cost of each method, e.g. "eth_getLogs=75,eth_call=26" for compute-unit budgets; others cost 1
+RPC_METHOD_COSTS = {
+    method.strip(): float(cost)
+    for method, cost in (item.split("=") for item in os.environ.get("RPC_METHOD_COSTS", "").split(",") if item.strip())
+}
+# Attempts per request while providers keep answering that it is rate limited
+RPC_MAX_ATTEMPTS = int(os.environ.get("RPC_MAX_ATTEMPTS", "5"))
+# Consecutive transport failures or error responses that open an endpoint's circuit breaker
+RPC_BREAKER_FAILURES = int(os.environ.get("RPC_BREAKER_FAILURES", "5"))
+# Seconds an open circuit breaker keeps an endpoint out of rotation before a trial request
+RPC_BREAKER_COOLDOWN = float(os.environ.get("RPC_BREAKER_COOLDOWN", "30"))
+# Ceiling of any exponential backoff, in seconds
+BACKOFF_CAP = 60
+# Error messages providers use for rate limiting inside a JSON-RPC response
+RATE_LIMIT_MARKERS = ("rate limit", "too many requests", "compute units", "exceeded its throughput")
+# Error messages providers use when a block window is too large or too slow to answer
+WINDOW_TOO_LARGE_MARKERS = (
+    "more than",
+    "too many",
+    "limit exceeded",
+    "response size",
+    "block range",
+    "timeout",
+    "timed out",
+)
+# Seconds before a lean request times out, as for web3's HTTP providers
+LEAN_REQUEST_TIMEOUT = 10
+LEAN_HEADERS = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+
+# orjson parses large eth_getLogs responses several times faster when it is installed
+if orjson is not None:
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+else:
+    def json_dumps(value):
+        return json.dumps(value).encode()
+
+    json_loads = json.loads
+
+request_ids = itertools.count()
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def backoff_delay(attempt, base):
+    """Exponential backoff before the nth retry, with jitter so clients that failed
+    together do not retry together"""
+    delay = min(BACKOFF_CAP, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class RateLimited(Exception):
+    """An endpoint refused a request for exceeding its rate limit"""
+
+    def __init__(self, url, retry_after=None):
+        super().__init__(f"rate limited by {url}")
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(headers):
+    """The Retry-After header in seconds, or None if it is missing or an HTTP date"""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_error(url, error):
+    """A RateLimited for an HTTP 429 raised by requests or aiohttp, otherwise None"""
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return RateLimited(url, retry_after_seconds(response.headers))
+    if getattr(error, "status", None) == 429:
+        return RateLimited(url, retry_after_seconds(error.headers or {}))
+    return None
+
+
+def is_rate_limit_response(response):
+    error = response.get("error")
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get("message", "")).lower()
+    return error.get("code") == 429 or any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+def is_window_error_response(response):
+    """Whether an error response asks for a smaller block window. Any endpoint may refuse
+    the same window, so it goes straight back to the caller to split it."""
+    error = response.get("error") if isinstance(response, dict) else None
+    if error is None:
+        return False
+    message = str(error.get("message", "") if isinstance(error, dict) else error)
+    return any(marker in message.lower() for marker in WINDOW_TOO_LARGE_MARKERS)
+
+
+def is_error_response(response):
+    """Whether a JSON-RPC response reports a failure of the endpoint, such as a missing
+    header or trie node. Reverts and window size errors are answers about the request
+    itself and rate limits are handled by the endpoint's budget, so none of them counts."""
+    error = response.get("error") if isinstance(response, dict) else None
+    if error is None:
+        return False
+    if not isinstance(error, dict):
+        return not is_window_error_response(response)
+    message = str(error.get("message", "")).lower()
+    return (
+        error.get("code") != 3
+        and "revert" not in message
+        and not is_rate_limit_response(response)
+        and not is_window_error_response(response)
+    )
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` cost units per second. reserve() takes the tokens
+    up front and returns how long to wait, so nobody sleeps while holding a lock. A rate
+    limit pauses the bucket, voids the reservations made before it and cuts the rate,
+    which then creeps back up to the configured value."""
+
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # Number of rate limits so far; a reservation is void once this changes
+        self.pauses = 0
+        self.rate_limits = 0
+
+    def reserve(self, cost):
+        """Take `cost` tokens; returns (seconds to wait, pauses) where pauses identifies
+        the reservation for still_valid()"""
+        now = time.monotonic()
+        # Tokens only refill once a pause is over
+        start = max(now, self.paused_until)
+        if not self.rate:
+            return start - now, self.pauses
+        self.tokens = min(self.burst, self.tokens + max(0.0, start - self.updated) * self.rate)
+        self.updated = max(self.updated, start)
+        self.tokens -= cost
+        return start - now + max(0.0, -self.tokens / self.rate), self.pauses
+
+    def still_valid(self, pauses):
+        return pauses == self.pauses
+
+    def succeeded(self):
+        self.rate_limits = 0
+        if self.rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+    def rate_limited(self, retry_after):
+        now = time.monotonic()
+        if now < self.paused_until:
+            # A request sent before the current pause began; already accounted for
+            return
+        self.rate_limits += 1
+        self.pauses += 1
+        if retry_after is None:
+            retry_after = backoff_delay(self.rate_limits, 1)
+        self.paused_until = now + retry_after
+        if self.rate:
+            self.rate = max(self.rate * 0.8, self.max_rate / 20)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+class CircuitBreaker:
+    """Takes an endpoint out of rotation after repeated failures. Once the
+    cooldown has passed a single trial request is let through, and its outcome closes
+    or re-opens the breaker."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def retry_in(self):
+        """Seconds until the endpoint may be used again; 0 if it may be used now"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def before_request(self):
+        # Re-arm an elapsed breaker so only this trial request goes through
+        if self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+    def succeeded(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failed(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class Endpoint:
+    """One RPC URL with its latency samples per method, a moving error rate, its own
+    rate-limit budget and a circuit breaker"""
+
+    def __init__(self, url):
+        self.url = url
+        self.provider = HTTPProvider(url)
+        self.async_provider = AsyncHTTPProvider(url)
+        self.latencies = {}
+        self.error_rate = 0.0
+        self.bucket = TokenBucket(RPC_RATE_LIMIT, RPC_BURST)
+        self.breaker = CircuitBreaker(RPC_BREAKER_FAILURES, RPC_BREAKER_COOLDOWN)
+        # Keep-alive sessions of the lean transport; aiohttp sessions belong to one event loop
+        self.session = requests.Session()
+        self.async_sessions = {}
+
+    def lean_request_body(self, method, params):
+        return json_dumps({"jsonrpc": "2.0", "id": next(request_ids), "method": method, "params": params})
+
+    def post_lean(self, method, params):
+        """Send a JSON-RPC request without web3's middleware and return the parsed response"""
+        response = self.session.post(
+            self.provider.endpoint_uri,
+            data=self.lean_request_body(method, params),
+            headers=LEAN_HEADERS,
+            timeout=LEAN_REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        return json_loads(response.content)
+
+    async def post_lean_async(self, method, params):
+        """Async counterpart of post_lean"""
+        loop = asyncio.get_running_loop()
+        session = self.async_sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=LEAN_REQUEST_TIMEOUT))
+            self.async_sessions[loop] = session
+        async with session.post(
+            self.provider.endpoint_uri, data=self.lean_request_body(method, params), headers=LEAN_HEADERS
+        ) as response:
+            response.raise_for_status()
+            return json_loads(await response.read())
+
+    async def close_async_session(self):
+        session = self.async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def record(self, method, elapsed=None):
+        """Record a response after `elapsed` seconds, or a failure if elapsed is None"""
+        failed = elapsed is None
+        self.error_rate += ERROR_DECAY * (failed - self.error_rate)
+        if not failed:
+            self.latencies.setdefault(method, deque(maxlen=LATENCY_SAMPLES)).append(elapsed)
+
+    def score(self, method):
+        """Expected cost of a request; lower is healthier. Unmeasured endpoints score 0
+        so every endpoint gets tried early, and a rate-limit pause counts as latency."""
+        samples = self.latencies.get(method)
+        latency = percentile(samples, 0.5) if samples else 0.0
+        pause = max(0.0, self.bucket.paused_until - time.monotonic())
+        return latency * (1 + ERROR_PENALTY * self.error_rate) + pause
+
+    def hedge_delay(self, method):
+        """p95 latency of this endpoint for a method, or None until enough samples exist"""
+        samples = self.latencies.get(method)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(samples, 0.95)
+
+
+class EndpointPool:
+    """Several RPC endpoints ranked by health, shared by the sync and async providers.
+    Every request is scheduled through its endpoint's token bucket and circuit breaker."""
+
+    def __init__(self, urls):
+        self.endpoints = [Endpoint(url) for url in urls]
+        # filter id -> Endpoint that created it
+        self.filter_endpoints = {}
+        self.lock = threading.Lock()
+
+    def ranked(self, method, params):
+        """Endpoints to try for a request, healthiest first, leaving out those whose
+        circuit breaker is open"""
+        if method in FILTER_METHODS and params and params[0] in self.filter_endpoints:
+            return [self.filter_endpoints[params[0]]]
+
+        with self.lock:
+            available = [endpoint for endpoint in self.endpoints if endpoint.breaker.retry_in() == 0]
+            ranked = sorted(available, key=lambda endpoint: endpoint.score(method))
+        if len(ranked) > 1 and random.random() < EXPLORE_RATE:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def retry_in(self):
+        """Seconds until some endpoint's circuit breaker lets a request through"""
+        with self.lock:
+            return min(endpoint.breaker.retry_in() for endpoint in self.endpoints)
+
+    def reserve(self, endpoint, method, reservation=None):
+        """Take a request's cost from the endpoint's budget; returns (seconds to wait,
+        reservation). Passing the previous reservation after waiting returns no wait if
+        it is still valid, or queues the request again behind a rate-limit pause."""
+        with self.lock:
+            if reservation is not None and endpoint.bucket.still_valid(reservation):
+                return 0.0, reservation
+            endpoint.breaker.before_request()
+            return endpoint.bucket.reserve(RPC_METHOD_COSTS.get(method, 1))
+
+    def record(self, endpoint, method, params, response=None, elapsed=None, error=None):
+        """Record the outcome of a request. Returns a RateLimited to raise if the endpoint
+        refused it for its rate limit, otherwise None."""
+        rate_limited = rate_limit_error(endpoint.url, error) if error is not None else None
+        if rate_limited is None and response is not None and is_rate_limit_response(response):
+            rate_limited = RateLimited(endpoint.url)
+
+        with self.lock:
+            if rate_limited is not None:
+                endpoint.bucket.rate_limited(rate_limited.retry_after)
+            elif error is not None:
+                endpoint.record(method)
+                endpoint.breaker.failed()
+            elif is_error_response(response):
+                # A quick error is no sign of health
+                endpoint.record(method)
+                endpoint.breaker.failed()
+            elif is_window_error_response(response):
+                # Neither a failure nor a latency sample of the endpoint
+                endpoint.bucket.succeeded()
+            else:
+                endpoint.record(method, elapsed)
+                endpoint.bucket.succeeded()
+                endpoint.breaker.succeeded()
+        if method == "eth_newFilter" and response is not None and "result" in response:
+            self.filter_endpoints[response["result"]] = endpoint
+        return rate_limited
+
+
+def rpc_urls(value):
+    """Split a comma-separated POLYGON_RPC_URL into its URLs; an unset value keeps
+    web3's default endpoint"""
+    return [url.strip() for url in (value or "").split(",") if url.strip()] or [None]
+
+
+class PooledHTTPProvider(JSONBaseProvider):
+    """HTTP provider scheduling every request over an EndpointPool. Transport errors and
+    error responses other than reverts and window size errors fail over to the next
+    endpoint, rate-limited requests are retried once an endpoint's pause has passed, and
+    HEDGED_METHODS are sent to a second endpoint when the first passes its p95 latency;
+    whichever answers first wins."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(max_workers=4 * len(pool.endpoints))
+
+    def is_connected(self, show_traceback=False):
+        return any(endpoint.provider.is_connected(show_traceback) for endpoint in self.pool.endpoints)
+
+    def call_endpoint(self, endpoint, method, params, lean):
+        delay, reservation = self.pool.reserve(endpoint, method)
+        while delay > 0:
+            time.sleep(delay)
+            delay, reservation = self.pool.reserve(endpoint, method, reservation)
+        started = time.monotonic()
+        try:
+            if lean:
+                response = endpoint.post_lean(method, params)
+            else:
+                response = endpoint.provider.make_request(method, params)
+        except Exception as e:
+            rate_limited = self.pool.record(endpoint, method, params, error=e)
+            if rate_limited is not None:
+                raise rate_limited from e
+            raise
+        rate_limited = self.pool.record(endpoint, method, params, response, time.monotonic() - started)
+        if rate_limited is not None:
+            raise rate_limited
+        return response
+
+    def make_request(self, method, params):
+        return self.schedule(method, params, lean=False)
+
+    def make_lean_request(self, method, params):
+        """Schedule a request like make_request, but send it on a keep-alive session and
+        return the parsed JSON-RPC response without web3's formatters. `params` must
+        already be in their JSON-RPC form."""
+        return self.schedule(method, params, lean=True)
+
+    def schedule(self, method, params, lean):
+        attempts = 0
+        while True:
+            ranked = self.pool.ranked(method, params)
+            if not ranked:
+                # Every circuit breaker is open; wait for the first trial request
+                time.sleep(self.pool.retry_in())
+                continue
+            try:
+                if method not in HEDGED_METHODS or len(ranked) < 2:
+                    return self.failover(ranked, method, params, lean)
+                return self.hedge(ranked, method, params, lean)
+            except RateLimited:
+                attempts += 1
+                if attempts >= RPC_MAX_ATTEMPTS:
+                    raise
+
+    def hedge(self, ranked, method, params, lean):
+        futures = {self.executor.submit(self.call_endpoint, ranked[0], method, params, lean)}
+        backups = ranked[1:]
+        delay = ranked[0].hedge_delay(method)
+        error = None
+        error_response = None
+        while futures:
+            done, futures = wait(futures, timeout=delay if backups else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if not is_error_response(response):
+                    return response
+                error_response = response
+            # Hedge once the p95 has passed, or fail over right away after an error
+            if backups and (not done or not futures):
+                futures.add(self.executor.submit(self.call_endpoint, backups.pop(0), method, params, lean))
+                delay = None
+        # Every endpoint failed; an error response tells the caller more than a transport error
+        if error_response is not None:
+            return error_response
+        raise error
+
+    def failover(self, ranked, method, params, lean):
+        """Try the endpoints in turn until one answers without an error. The last one's
+        error response is returned as is."""
+        for i, endpoint in enumerate(ranked):
+            try:
+                response = self.call_endpoint(endpoint, method, params, lean)
+            except Exception:
+                if i == len(ranked) - 1:
+                    raise
+                continue
+            if i == len(ranked) - 1 or not is_error_response(response):
+                return response
+
+
+class AsyncPooledHTTPProvider(AsyncJSONBaseProvider):
+    """Async counterpart of PooledHTTPProvider"""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    async def is_connected(self, show_traceback=False):
+        for endpoint in self.pool.endpoints:
+            if await endpoint.async_provider.is_connected(show_traceback):
+                return True
+        return False
+
+    async def call_endpoint(self, endpoint, method, params, lean):
+        delay, reservation = self.pool.reserve(endpoint, method)
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay, reservation = self.pool.reserve(endpoint, method, reservation)
+        started = time.monotonic()
+        try:
+            if lean:
+                response = await endpoint.post_lean_async(method, params)
+            else:
+                response = await endpoint.async_provider.make_request(method, params)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            rate_limited = self.pool.record(endpoint, method, params, error=e)
+            if rate_limited is not None:
+                raise rate_limited from e
+            raise
+        rate_limited = self.pool.record(endpoint, method, params, response, time.monotonic() - started)
+        if rate_limited is not None:
+            raise rate_limited
+        return response
+
+    async def make_request(self, method, params):
+        return await self.schedule(method, params, lean=False)
+
+    async def make_lean_request(self, method, params):
+        """Async counterpart of PooledHTTPProvider.make_lean_request"""
+        return await self.schedule(method, params, lean=True)
+
+    async def close_lean_sessions(self):
+        """Close the lean sessions of the running event loop before it ends"""
+        for endpoint in self.pool.endpoints:
+            await endpoint.close_async_session()
+
+    async def schedule(self, method, params, lean):
+        attempts = 0
+        while True:
+            ranked = self.pool.ranked(method, params)
+            if not ranked:
+                await asyncio.sleep(self.pool.retry_in())
+                continue
+            try:
+                if method not in HEDGED_METHODS or len(ranked) < 2:
+                    return await self.failover(ranked, method, params, lean)
+                return await self.hedge(ranked, method, params, lean)
+            except RateLimited:
+                attempts += 1
+                if attempts >= RPC_MAX_ATTEMPTS:
+                    raise
+
+    async def hedge(self, ranked, method, params, lean):
+        tasks = {asyncio.ensure_future(self.call_endpoint(ranked[0], method, params, lean))}
+        backups = ranked[1:]
+        delay = ranked[0].hedge_delay(method)
+        error = None
+        error_response = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, timeout=delay if backups else None, return_when=asyncio.FIRST_COMPLETED)
+                # Retrieve every outcome so a failed loser is not reported as unhandled
+                outcomes = [(task, task.exception()) for task in done]
+                for task, exception in outcomes:
+                    if exception is not None:
+                        error = exception
+                    elif not is_error_response(task.result()):
+                        return task.result()
+                    else:
+                        error_response = task.result()
+                # Hedge once the p95 has passed, or fail over right away after an error
+                if backups and (not done or not tasks):
+                    tasks.add(asyncio.ensure_future(self.call_endpoint(backups.pop(0), method, params, lean)))
+                    delay = None
+            if error_response is not None:
+                return error_response
+            raise error
+        finally:
+            # The losing request is no longer needed
+            for task in tasks:
+                task.cancel()
+
+    async def failover(self, ranked, method, params, lean):
+        for i, endpoint in enumerate(ranked):
+            try:
+                response = await self.call_endpoint(endpoint, method, params, lean)
+            except Exception:
+                if i == len(ranked) - 1:
+                    raise
+                continue
+            if i == len(ranked) - 1 or not is_error_response(response):
+                return response
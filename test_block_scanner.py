@@ -0,0 +1,15 @@
+from block_scanner import AdaptiveWindow
+
+
+def test_window_does_not_regrow_past_a_refused_size():
+    window = AdaptiveWindow(0, 1_000_000, 100_000, min_size=1_000, max_size=500_000)
+    from_block, to_block = window.claim()
+    window.fail(from_block, to_block, ValueError("block range is too wide"))
+    assert window.max_size == 99_999
+
+    # Fast, small windows keep asking to double
+    while not window.done():
+        from_block, to_block = window.claim()
+        assert to_block - from_block + 1 <= 99_999
+        window.complete(from_block, to_block, elapsed=0.1, result_count=0)
+    assert window.size <= 99_999